@@ -1,37 +1,33 @@
 import requests
-import cv2
-import numpy as np
-import pytesseract
-import os
-from pytesseract import TesseractNotFoundError
+from requests.adapters import HTTPAdapter
+from components.ocr_component import get_ocr_pool
+
+# One pooled session per process, image fetches reuse their TCP/TLS connections
+session = requests.Session()
+session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=10))
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=10))
+
+# (connect, read) seconds
+REQUEST_TIMEOUT = (3.05, 30)
+# Larger responses are refused instead of being held in memory, matches the Media upload limit
+MAX_IMAGE_SIZE = 2 * 1024 * 1024
 
 class ImageComponent:
 
     def image_to_text(image_url: str) -> list[str]:
         try:
             # Fetch the image content
-            response = requests.get(image_url)
-            response.raise_for_status()
-
-            # Convert image content to a NumPy array
-            image_array = np.frombuffer(response.content, np.uint8)
-
-            # Decode the image using OpenCV
-            image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
+            with session.get(image_url, timeout=REQUEST_TIMEOUT, stream=True) as response:
+                response.raise_for_status()
 
-            # Convert to grayscale if needed
-            gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+                content = bytearray()
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    content.extend(chunk)
+                    if len(content) > MAX_IMAGE_SIZE:
+                        raise ValueError(f"Image is larger than {MAX_IMAGE_SIZE} bytes.")
 
-            # Use Pytesseract to extract text
-            pytesseract.pytesseract.tesseract_cmd = os.getenv('TESSERACT_CMD_PATH', r'C:\Program Files\Tesseract-OCR\tesseract.exe')
-            extracted_text = pytesseract.image_to_string(gray_image)
-
-            # Return the extracted text as a list of lines
-            return extracted_text.splitlines()
-
-        except TesseractNotFoundError:
-            print("Tesseract is not installed or not found. Please install Tesseract.")
-            return []  # Return an empty list in case Tesseract is not found
+            # Decoding and Tesseract run in the OCR worker pool
+            return get_ocr_pool().image_to_text(content)
 
         except requests.RequestException as e:
             print(f"Error fetching the image: {e}")
@@ -44,4 +40,12 @@ class ImageComponent:
         #lines = extracted_text.split("\n")
 
         # Add line numbers
-        #return [f"{i + 1}: {line}" for i, line in enumerate(lines)]
\ No newline at end of file
+        #return [f"{i + 1}: {line}" for i, line in enumerate(lines)]
+
+    def file_to_text(disk: str, path: str) -> list[str]:
+        """Text of an image on a storage disk, read by the OCR worker without signing a URL."""
+        return get_ocr_pool().file_to_text(disk, path)
+
+    def media_to_text(media) -> list[str]:
+        """Text of the image behind a Media row."""
+        return ImageComponent.file_to_text(media.disk or 's3', media.file_path)
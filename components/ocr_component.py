@@ -0,0 +1,424 @@
+import atexit
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import django
+import numpy as np
+import pytesseract
+from PIL import Image
+from django.conf import settings
+
+from mysite.performance import ocr_call
+
+
+class OcrQueueFull(Exception):
+    """Raised by ``OcrComponent.submit`` when the pool already has ``queue_size`` jobs."""
+
+
+class ReusableBuffer:
+    """
+    Writable, seekable in-memory file whose storage is kept between uses.
+
+    Each worker process downloads every image into the same buffer, so after
+    the first few jobs no memory is allocated for the image bytes anymore.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+        self._size = 0
+
+    def reset(self):
+        self._position = 0
+        self._size = 0
+
+    def write(self, data) -> int:
+        end = self._position + len(data)
+        if end > len(self._buffer):
+            # Grow geometrically, the buffer is never shrunk
+            self._buffer.extend(bytearray(max(end - len(self._buffer), len(self._buffer))))
+        self._buffer[self._position:end] = data
+        self._position = end
+        self._size = max(self._size, end)
+        return len(data)
+
+    def read(self, size: int = -1) -> bytes:
+        end = self._size if size is None or size < 0 else min(self._position + size, self._size)
+        data = bytes(self._buffer[self._position:end])
+        self._position = max(end, self._position)
+        return data
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        if whence == 1:
+            offset += self._position
+        elif whence == 2:
+            offset += self._size
+        self._position = offset
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+    def seekable(self) -> bool:
+        return True
+
+    def writable(self) -> bool:
+        return True
+
+    def readable(self) -> bool:
+        return True
+
+    def getbuffer(self) -> memoryview:
+        """View of the written bytes, release it before the next write."""
+        return memoryview(self._buffer)[:self._size]
+
+
+_buffer = ReusableBuffer()
+
+
+def _init_worker(tesseract_cmd: str):
+    # Runs once per worker process, the state below is reused by every job it handles
+    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    # Parallelism comes from the pool, one OpenCV thread per worker avoids oversubscription
+    cv2.setNumThreads(1)
+    # Storage adapters need the app registry, the worker inherits DJANGO_SETTINGS_MODULE
+    django.setup()
+
+
+def _decode(content) -> np.ndarray:
+    """Decode an encoded image from any bytes-like object without copying it first."""
+    image_array = np.frombuffer(content, np.uint8)
+    image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode the image.")
+    return image
+
+
+def image_dpi(file) -> float:
+    """
+    Horizontal resolution recorded in an encoded image (JPEG, PNG, TIFF), None when it
+    records none. Pillow only parses the header, the pixels are decoded by OpenCV.
+    """
+    try:
+        with Image.open(file) as image:
+            dpi = image.info.get('dpi')
+    except Exception:
+        return None
+    if not dpi or not dpi[0]:
+        return None
+    return float(dpi[0])
+
+
+DEFAULT_PREPROCESSING = {
+    'enabled': True,
+    'source_dpi': None,  # Resolution of scans that do not record one, None leaves them at their size
+    'target_dpi': 300,  # Tesseract is tuned for text at about 300 DPI
+    'threshold_block_size': 31,  # Odd, neighbourhood in pixels of the adaptive threshold
+    'threshold_c': 15,
+    'deskew': True,
+    'max_skew': 10,  # Degrees, larger angles are assumed to be layout and left alone
+    'regions': True,
+    'region_padding': 8,
+    'min_region_area': 300,
+    'region_workers': 2,  # Tesseract processes per job, on top of the pool's workers
+}
+
+
+def get_preprocessing() -> dict:
+    """DEFAULT_PREPROCESSING overridden by the OCR_PREPROCESSING setting."""
+    return {**DEFAULT_PREPROCESSING, **getattr(settings, 'OCR_PREPROCESSING', {})}
+
+
+def downscale(gray: np.ndarray, source_dpi: float, target_dpi: int) -> np.ndarray:
+    """Resample a scan to ``target_dpi``, images at or below it or of unknown resolution are kept as they are."""
+    if not source_dpi:
+        return gray
+    scale = target_dpi / source_dpi
+    if scale >= 1:
+        return gray
+    return cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+def binarize(gray: np.ndarray, block_size: int, c: int) -> np.ndarray:
+    """Black text on white, thresholded against the local background so shading and stains drop out."""
+    # A 3x3 median removes salt-and-pepper noise that would otherwise survive as specks
+    gray = cv2.medianBlur(gray, 3)
+    return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, block_size | 1, c)
+
+
+def deskew(binary: np.ndarray, max_skew: float) -> np.ndarray:
+    """Rotate the page so the text lines are horizontal."""
+    points = cv2.findNonZero(cv2.bitwise_not(binary))
+    if points is None:
+        return binary
+
+    angle = cv2.minAreaRect(points)[-1]
+    # minAreaRect reports (0, 90], fold it around the horizontal
+    if angle > 45:
+        angle -= 90
+    if abs(angle) < 0.1 or abs(angle) > max_skew:
+        return binary
+
+    height, width = binary.shape
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    return cv2.warpAffine(binary, matrix, (width, height), flags=cv2.INTER_NEAREST, borderValue=255)
+
+
+def text_regions(binary: np.ndarray, min_area: int, padding: int) -> list[tuple]:
+    """
+    Bounding boxes (x, y, w, h) of the text blocks, in reading order.
+    Characters are smeared horizontally into lines and blocks so every box holds whole lines.
+    """
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (25, 7))
+    smeared = cv2.dilate(cv2.bitwise_not(binary), kernel)
+    contours, _ = cv2.findContours(smeared, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    height, width = binary.shape
+    regions = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if w * h < min_area:
+            continue
+        x0, y0 = max(x - padding, 0), max(y - padding, 0)
+        x1, y1 = min(x + w + padding, width), min(y + h + padding, height)
+        regions.append((x0, y0, x1 - x0, y1 - y0))
+
+    # Top to bottom, then left to right
+    return sorted(regions, key=lambda region: (region[1], region[0]))
+
+
+def preprocess(image: np.ndarray, preprocessing: dict, dpi: float = None) -> tuple[np.ndarray, list[tuple]]:
+    """
+    Run the configured stages on a BGR image, returns the page and the regions to read.
+    :param dpi: resolution recorded in the image file, ``source_dpi`` is assumed without it
+    """
+    page = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if not preprocessing['enabled']:
+        return page, []
+
+    page = downscale(page, dpi or preprocessing['source_dpi'], preprocessing['target_dpi'])
+    page = binarize(page, preprocessing['threshold_block_size'], preprocessing['threshold_c'])
+    if preprocessing['deskew']:
+        page = deskew(page, preprocessing['max_skew'])
+
+    regions = []
+    if preprocessing['regions']:
+        regions = text_regions(page, preprocessing['min_region_area'], preprocessing['region_padding'])
+    return page, regions
+
+
+def _tesseract(image: np.ndarray, timeout: float = 0, config: str = '') -> str:
+    # Tesseract is killed once the job runs past its timeout (0 = no limit)
+    try:
+        return pytesseract.image_to_string(image, timeout=timeout, config=config)
+    except (pytesseract.TesseractNotFoundError, pytesseract.TesseractError) as exception:
+        # These do not survive pickling back to the parent, it would see a broken pool instead
+        raise RuntimeError(str(exception)) from None
+
+
+def recognize(image: np.ndarray, timeout: float = 0, preprocessing: dict = None, dpi: float = None) -> list[str]:
+    """
+    Text lines of a BGR image. With regions enabled only the detected text
+    blocks are read, each as a uniform block (psm 6), several at a time.
+    ``timeout`` bounds the whole image (0 = no limit), regions share it.
+    """
+    deadline = time.monotonic() + timeout if timeout else None
+    preprocessing = preprocessing or get_preprocessing()
+    page, regions = preprocess(image, preprocessing, dpi)
+    if not regions:
+        return _tesseract(page, _remaining(deadline)).splitlines()
+
+    def read(crop):
+        # Regions still queued once the deadline passed are skipped, the running ones are killed by Tesseract's timeout
+        return _tesseract(crop, _remaining(deadline), '--psm 6')
+
+    crops = [page[y:y + h, x:x + w] for x, y, w, h in regions]
+    # pytesseract runs tesseract as a subprocess, threads are enough to run them in parallel
+    with ThreadPoolExecutor(max_workers=max(preprocessing['region_workers'], 1)) as executor:
+        texts = executor.map(read, crops)
+        return [line for text in texts for line in text.splitlines() if line.strip()]
+
+
+def _remaining(deadline: float) -> float:
+    """Seconds left before ``deadline`` as a Tesseract timeout (0 = no limit), raises once it has passed."""
+    if deadline is None:
+        return 0
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise RuntimeError("Tesseract process timeout")
+    return remaining
+
+
+def _image_to_text(content: bytes, timeout: float = 0) -> list[str]:
+    """Decode an image and run Tesseract on it, executed in a worker process."""
+    return recognize(_decode(content), timeout, dpi=image_dpi(io.BytesIO(content)))
+
+
+def _file_to_text(disk: str, path: str, timeout: float = 0) -> list[str]:
+    """
+    Read an image from a storage disk and run Tesseract on it, executed in a worker process.
+    Only the disk and path cross the process boundary, the bytes go from the
+    adapter straight into the worker's buffer and are decoded in place.
+    """
+    from components.storage_component import StorageComponent
+
+    _buffer.reset()
+    if not StorageComponent().disk(disk).reading().download(path, _buffer):
+        raise RuntimeError(f"Could not read '{path}' from the '{disk}' disk.")
+
+    _buffer.seek(0)
+    dpi = image_dpi(_buffer)
+    view = _buffer.getbuffer()
+    try:
+        image = _decode(view)
+    finally:
+        view.release()
+    return recognize(image, timeout, dpi=dpi)
+
+
+class OcrComponent:
+    """
+    Pool of OCR worker processes.
+
+    Tesseract is CPU bound and would block a request thread (and the GIL) for
+    seconds, so images are handed to warm worker processes. ``submit`` returns a
+    Future right away. At most ``queue_size`` jobs are waiting or running, a
+    further ``submit`` raises OcrQueueFull so callers shed load instead of
+    queueing without bound.
+    """
+
+    def __init__(self, workers: int = None, queue_size: int = None, timeout: float = None):
+        self.workers = workers or getattr(settings, 'OCR_WORKERS', None) or os.cpu_count() or 1
+        self.queue_size = queue_size or getattr(settings, 'OCR_QUEUE_SIZE', self.workers * 4)
+        self.timeout = timeout if timeout is not None else getattr(settings, 'OCR_TIMEOUT', 30)
+        self.tesseract_cmd = os.getenv('TESSERACT_CMD_PATH', r'C:\Program Files\Tesseract-OCR\tesseract.exe')
+        self._slots = threading.BoundedSemaphore(self.queue_size)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    # spawn, forking a threaded server process can deadlock the child
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.tesseract_cmd,),
+                )
+            return self._executor
+
+    def _reset_executor(self, broken: ProcessPoolExecutor):
+        """Drop an executor whose worker died, the next submit starts a fresh one."""
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, content: bytes, timeout: float = None, wait: float = 0) -> Future:
+        """
+        Queue OCR of an encoded image (jpg, png, ...).
+
+        :param timeout: seconds Tesseract may run for this job, defaults to OCR_TIMEOUT
+        :param wait: seconds to wait for a free slot before giving up
+        :return: Future resolving to the list of text lines
+        """
+        return self._submit(_image_to_text, content, timeout=timeout, wait=wait)
+
+    def submit_file(self, disk: str, path: str, timeout: float = None, wait: float = 0) -> Future:
+        """Queue OCR of an image stored on ``disk``, the worker reads it from storage itself."""
+        return self._submit(_file_to_text, disk, path, timeout=timeout, wait=wait)
+
+    def _submit(self, function, *args, timeout: float = None, wait: float = 0) -> Future:
+        acquired = self._slots.acquire(timeout=wait) if wait else self._slots.acquire(blocking=False)
+        if not acquired:
+            raise OcrQueueFull(f"OCR queue is full ({self.queue_size} jobs).")
+
+        timeout = self.timeout if timeout is None else timeout
+        executor = self._get_executor()
+        try:
+            future = executor.submit(function, *args, timeout)
+        except BrokenProcessPool:
+            self._reset_executor(executor)
+            executor = self._get_executor()
+            try:
+                future = executor.submit(function, *args, timeout)
+            except Exception:
+                self._slots.release()
+                raise
+        except Exception:
+            self._slots.release()
+            raise
+
+        def done(finished: Future):
+            self._slots.release()
+            if isinstance(finished.exception(), BrokenProcessPool):
+                self._reset_executor(executor)
+
+        future.add_done_callback(done)
+        return future
+
+    def result(self, future: Future, timeout: float = None) -> list[str]:
+        """
+        Wait for a submitted job. Returns an empty list when the job failed or
+        did not finish within ``timeout`` seconds (defaults to OCR_TIMEOUT).
+        """
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            with ocr_call():
+                return future.result(timeout=timeout or None)
+        except TimeoutError:
+            logging.error("OCR job timed out.")
+        except Exception as exception:
+            logging.error(f"OCR job failed: {exception}")
+        return []
+
+    def image_to_text(self, content: bytes, timeout: float = None) -> list[str]:
+        """Submit and wait, for callers that are already off the request path."""
+        try:
+            return self.result(self.submit(content, timeout=timeout), timeout=timeout)
+        except OcrQueueFull as exception:
+            logging.error(f"{exception}")
+            return []
+
+    def file_to_text(self, disk: str, path: str, timeout: float = None) -> list[str]:
+        try:
+            return self.result(self.submit_file(disk, path, timeout=timeout), timeout=timeout)
+        except OcrQueueFull as exception:
+            logging.error(f"{exception}")
+            return []
+
+    def worker_pids(self) -> list[int]:
+        """Process ids of the running workers, none before the first submit."""
+        with self._lock:
+            executor = self._executor
+        # ProcessPoolExecutor keeps its workers by pid and has no public accessor for them
+        return list(getattr(executor, '_processes', None) or {})
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_ocr_pool() -> OcrComponent:
+    """Return the process-wide OCR pool, its workers are started on the first submit."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = OcrComponent()
+                atexit.register(_pool.shutdown)
+    return _pool
@@ -1,26 +1,452 @@
+import bisect
+import functools
 import hashlib
+import io
 import logging
+import mimetypes
 import os
+import shutil
+import threading
 import time
+from collections import OrderedDict
+from contextvars import ContextVar
 from pathlib import Path
 from uuid import uuid4
 
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
+from fs.base import FS
 from fs.errors import ResourceNotFound
+from fs.iotools import make_stream
 from fs.osfs import OSFS
+from fs.path import abspath, dirname, normpath, relpath
+from fs.wrapfs import WrapFS
 from fs_s3fs import S3FS
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
 from django.templatetags.static import static
+from django.utils.module_loading import import_string
 from config.storage import config
-from modules.media.models import Media
+from modules.media.models import Media, MediaBlob
+from mysite.performance import storage_call
+
+
+class PooledS3FS(S3FS):
+    """
+    S3FS that shares one boto3 client per disk and applies the disk's botocore
+    config (connection pool size, retries) to its per-thread resources.
+    """
+
+    def __init__(self, *args, client=None, client_config=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._shared_client = client
+        self._client_config = client_config
+
+    @property
+    def s3(self):
+        # boto3 resources are not thread safe, keep one per thread like S3FS does
+        if not hasattr(self._tlocal, "s3"):
+            self._tlocal.s3 = boto3.resource(
+                "s3",
+                region_name=self.region,
+                aws_access_key_id=self.aws_access_key_id,
+                aws_secret_access_key=self.aws_secret_access_key,
+                aws_session_token=self.aws_session_token,
+                endpoint_url=self.endpoint_url,
+                config=self._client_config,
+            )
+        return self._tlocal.s3
+
+    @property
+    def client(self):
+        # boto3 clients are thread safe, share the pooled one
+        if self._shared_client is not None:
+            return self._shared_client
+        return super().client
+
+
+class CachedFS(WrapFS):
+    """
+    Read-through cache of a remote filesystem on a local OSFS directory.
+
+    Reads are served from the cache directory, a miss downloads the whole file
+    once. The cache holds at most ``max_size`` bytes, the least recently read
+    files are evicted first. Writes through this filesystem update the cache,
+    removes and moves invalidate it. Objects changed on the remote behind its
+    back are not noticed, so only cache disks whose keys are never rewritten in
+    place (unique or content-addressed names).
+    """
+
+    temp_dir = '/.tmp'
+
+    def __init__(self, wrap_fs, cache_fs: OSFS, max_size: int):
+        super().__init__(wrap_fs)
+        self.cache_fs = cache_fs
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # path -> size, least recently used first
+        self._size = 0
+        self._lock = threading.RLock()
+        self._load()
+
+    def _load(self):
+        """Index the files left in the cache directory by a previous process."""
+        self.cache_fs.makedir(self.temp_dir, recreate=True)
+        files = []
+        for path, info in self.cache_fs.walk.info(namespaces=['details'], exclude_dirs=[self.temp_dir.strip('/')]):
+            if info.is_file:
+                files.append((info.accessed or info.modified, path, info.size))
+        for _, path, size in sorted(files, key=lambda file: file[0].timestamp() if file[0] else 0):
+            self._entries[path] = size
+            self._size += size
+        with self._lock:
+            self._evict()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'size': self._size,
+                'max_size': self.max_size,
+            }
+
+    def temp_path(self) -> str:
+        """Local path to write a file to before it is stored with ``store``."""
+        return self.cache_fs.getsyspath(f"{self.temp_dir}/{uuid4().hex}")
+
+    def store(self, path: str, temp_path: str):
+        """Move a fully written local file into the cache as ``path``."""
+        key = abspath(normpath(path))
+        with self._lock:
+            self.cache_fs.makedirs(dirname(key), recreate=True)
+            os.replace(temp_path, self.cache_fs.getsyspath(key))
+            self._size -= self._entries.pop(key, 0)
+            self._entries[key] = os.path.getsize(self.cache_fs.getsyspath(key))
+            self._size += self._entries[key]
+            self._evict()
+
+    def invalidate(self, path: str):
+        key = abspath(normpath(path))
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)
+                try:
+                    os.remove(self.cache_fs.getsyspath(key))
+                except FileNotFoundError:
+                    pass
+
+    def _evict(self):
+        # Keep the most recent entry even when it is bigger than the cache on its own
+        while self._size > self.max_size and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._size -= size
+            try:
+                os.remove(self.cache_fs.getsyspath(key))
+            except FileNotFoundError:
+                pass
+
+    def _open_cached(self, path: str):
+        """Open the cached copy of ``path`` for reading, downloading it on a miss."""
+        key = abspath(normpath(path))
+        with self._lock:
+            if key in self._entries:
+                try:
+                    # Opened under the lock, an eviction can no longer pull the file away
+                    file = open(self.cache_fs.getsyspath(key), 'rb')
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return file
+                except FileNotFoundError:
+                    # Evicted by another process sharing the directory
+                    self._size -= self._entries.pop(key)
+            self.misses += 1
+
+        temp_path = self.temp_path()
+        try:
+            with open(temp_path, 'wb') as file:
+                self._wrap_fs.download(key, file)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        with self._lock:
+            self.store(key, temp_path)
+            return open(self.cache_fs.getsyspath(key), 'rb')
+
+    @staticmethod
+    def _is_read(mode: str) -> bool:
+        return not any(flag in mode for flag in 'wax+')
+
+    def openbin(self, path, mode='r', buffering=-1, **options):
+        if self._is_read(mode):
+            return self._open_cached(path)
+        self.invalidate(path)
+        return super().openbin(path, mode, buffering, **options)
+
+    def open(self, path, mode='r', buffering=-1, encoding=None, errors=None, newline='', line_buffering=False, **options):
+        if self._is_read(mode):
+            return make_stream(
+                path, self._open_cached(path), mode, buffering,
+                encoding=encoding, errors=errors, newline=newline, line_buffering=line_buffering
+            )
+        self.invalidate(path)
+        return super().open(path, mode, buffering, encoding, errors, newline, line_buffering, **options)
+
+    def readbytes(self, path):
+        with self._open_cached(path) as file:
+            return file.read()
+
+    def readtext(self, path, encoding=None, errors=None, newline=''):
+        return FS.readtext(self, path, encoding, errors, newline)
+
+    def download(self, path, file, chunk_size=None, **options):
+        with self._open_cached(path) as cached:
+            shutil.copyfileobj(cached, file, chunk_size or io.DEFAULT_BUFFER_SIZE)
+
+    def writebytes(self, path, contents):
+        super().writebytes(path, contents)
+        temp_path = self.temp_path()
+        with open(temp_path, 'wb') as file:
+            file.write(contents)
+        self.store(path, temp_path)
+
+    def upload(self, path, file, chunk_size=None, **options):
+        self.invalidate(path)
+        super().upload(path, file, chunk_size, **options)
+
+    def remove(self, path):
+        self.invalidate(path)
+        super().remove(path)
+
+    def move(self, src_path, dst_path, overwrite=False, preserve_time=False):
+        self.invalidate(src_path)
+        self.invalidate(dst_path)
+        # Not through WrapFS.move, S3FS.move does not take preserve_time
+        self._wrap_fs.move(src_path, dst_path, overwrite)
+
+
+class HashingReader:
+    """Read-only file wrapper counting the bytes read and feeding them into a hashlib object, when given."""
+
+    def __init__(self, fileobj, digest=None):
+        self._fileobj = fileobj
+        self.digest = digest
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._fileobj.read(size)
+        if self.digest is not None:
+            self.digest.update(data)
+        self.size += len(data)
+        return data
+
+
+class AdapterRegistry:
+    """
+    Process-wide, thread-safe cache of filesystem adapters and boto3 clients.
+    Building them resolves credentials and opens connections, so every
+    StorageComponent instance reuses the ones already built for a disk.
+    """
+
+    def __init__(self):
+        self.filesystems = {}
+        self.clients = {}
+        self._lock = threading.RLock()
+
+    def get_or_create(self, store: dict, key, factory):
+        """Return ``store[key]``, building it once with ``factory`` when missing."""
+        try:
+            return store[key]
+        except KeyError:
+            pass
+        with self._lock:
+            if key not in store:
+                instance = factory()
+                if instance is None:
+                    return None
+                store[key] = instance
+            return store[key]
+
+    def clear(self):
+        with self._lock:
+            self.filesystems.clear()
+            self.clients.clear()
+
+
+adapter_registry = AdapterRegistry()
+
+
+class StorageMetricsExporter:
+    """
+    Receives one observation per StorageComponent call. STORAGE_METRICS_EXPORTER
+    names the class used, a subclass can forward observations to a metrics
+    backend (StatsD, OpenTelemetry, ...) instead of keeping them in memory.
+    """
+
+    def observe(self, disk: str, operation: str, seconds: float, read: int = 0, written: int = 0, error: bool = False):
+        raise NotImplementedError
+
+
+class InMemoryExporter(StorageMetricsExporter):
+    """Per (disk, operation) latency histogram, byte and error counters kept in this process."""
+
+    # Upper bounds in seconds, local disk calls land in the first buckets and S3 round trips in the middle ones
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, disk: str, operation: str, seconds: float, read: int = 0, written: int = 0, error: bool = False):
+        with self._lock:
+            series = self._series.get((disk, operation))
+            if series is None:
+                series = self._series[(disk, operation)] = {
+                    'count': 0, 'sum': 0.0, 'buckets': [0] * len(self.buckets),
+                    'read': 0, 'written': 0, 'errors': 0,
+                }
+            series['count'] += 1
+            series['sum'] += seconds
+            index = bisect.bisect_left(self.buckets, seconds)
+            if index < len(self.buckets):
+                series['buckets'][index] += 1
+            series['read'] += read
+            series['written'] += written
+            series['errors'] += int(error)
+
+    def snapshot(self) -> dict:
+        """Copy of the series, ``{(disk, operation): {count, sum, buckets, read, written, errors}}``."""
+        with self._lock:
+            return {key: {**series, 'buckets': list(series['buckets'])} for key, series in self._series.items()}
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+class PrometheusExporter(InMemoryExporter):
+    """In-memory series rendered in the Prometheus text format, scraped from /metrics."""
+
+    def render(self) -> str:
+        lines = [
+            '# HELP storage_operation_seconds Duration of StorageComponent operations.',
+            '# TYPE storage_operation_seconds histogram',
+        ]
+        counters = {
+            'storage_read_bytes_total': ('read', 'Bytes read from storage.'),
+            'storage_written_bytes_total': ('written', 'Bytes written to storage.'),
+            'storage_errors_total': ('errors', 'StorageComponent operations that failed.'),
+        }
+        snapshot = sorted(self.snapshot().items())
+
+        for (disk, operation), series in snapshot:
+            labels = f'disk="{disk}",operation="{operation}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, series['buckets']):
+                cumulative += count
+                lines.append(f'storage_operation_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'storage_operation_seconds_bucket{{{labels},le="+Inf"}} {series["count"]}')
+            lines.append(f'storage_operation_seconds_sum{{{labels}}} {series["sum"]}')
+            lines.append(f'storage_operation_seconds_count{{{labels}}} {series["count"]}')
+
+        for name, (key, help_text) in counters.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for (disk, operation), series in snapshot:
+                lines.append(f'{name}{{disk="{disk}",operation="{operation}"}} {series[key]}')
+
+        # Cache disks this process has opened, the OCR workers keep their own counters
+        caches = sorted(
+            (disk, adapter.stats()) for disk, adapter in list(adapter_registry.filesystems.items())
+            if isinstance(adapter, CachedFS)
+        )
+        gauges = {
+            'storage_cache_hits_total': ('hits', 'counter', 'Reads served from a cache disk.'),
+            'storage_cache_misses_total': ('misses', 'counter', 'Reads a cache disk downloaded first.'),
+            'storage_cache_entries': ('entries', 'gauge', 'Files held by a cache disk.'),
+            'storage_cache_bytes': ('size', 'gauge', 'Bytes held by a cache disk.'),
+            'storage_cache_max_bytes': ('max_size', 'gauge', 'Size limit of a cache disk.'),
+        }
+        for name, (key, metric_type, help_text) in gauges.items() if caches else ():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for disk, stats in caches:
+                lines.append(f'{name}{{disk="{disk}"}} {stats[key]}')
+        return '\n'.join(lines) + '\n'
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_metrics_exporter() -> StorageMetricsExporter:
+    """Return the process-wide exporter configured by STORAGE_METRICS_EXPORTER."""
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                exporter_path = getattr(settings, 'STORAGE_METRICS_EXPORTER', 'components.storage_component.InMemoryExporter')
+                _exporter = import_string(exporter_path)()
+    return _exporter
+
+
+class StorageCall:
+    """Bytes moved by the StorageComponent call in progress, and whether it failed."""
+
+    __slots__ = ('read', 'written', 'error')
+
+    def __init__(self):
+        self.read = 0
+        self.written = 0
+        self.error = False
+
+
+_current_call = ContextVar('storage_call', default=None)
+
+
+def timed(operation: str, path_arg: int = 0):
+    """
+    Time a StorageComponent call into the metrics exporter and the request being
+    served (see mysite.performance). ``path_arg`` is the position of the path argument, None for none.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            path = args[path_arg] if path_arg is not None and len(args) > path_arg else None
+            call = StorageCall()
+            token = _current_call.set(call)
+            started = time.perf_counter()
+            try:
+                with storage_call(self.active_disk, operation, path):
+                    return method(self, *args, **kwargs)
+            except Exception:
+                call.error = True
+                raise
+            finally:
+                _current_call.reset(token)
+                try:
+                    get_metrics_exporter().observe(
+                        self.active_disk, operation, time.perf_counter() - started, call.read, call.written, call.error
+                    )
+                except Exception as exception:
+                    logging.error(f"Error exporting storage metrics: {exception}")
+        return wrapper
+    return decorator
 
 
 class StorageComponent:
 
     def __init__(self):
         self.config = config
-        self.filesystem = {}
+        self.filesystem = adapter_registry.filesystems
         self.active_disk = None
         self.disk_config = None
         self.default_disk = 'local'  # Default disk
@@ -38,22 +464,49 @@ class StorageComponent:
         """Set the active disk and initialize the corresponding adapter."""
         self.active_disk = disk or self.default_disk
 
-        if self.active_disk in self.filesystem:
-            return self
-
         try:
             self.disk_config = self.config['disks'][self.active_disk]
             driver = self.disk_config['driver']
             if driver == 'sftp':
-                self._create_sftp_driver()
+                factory = self._create_sftp_driver
             elif driver == 's3':
-                self._create_s3_driver()
+                factory = self._create_s3_driver
+            elif driver == 'cache':
+                factory = self._create_cache_driver
             else:
-                self._create_local_driver()
+                factory = self._create_local_driver
+            adapter_registry.get_or_create(self.filesystem, self.active_disk, factory)
         except Exception as exception:
             logging.error(f"Error initializing disk: {exception}")
         return self
 
+    def get_client(self, endpoint_url: str = None):
+        """
+        Return the shared boto3 S3 client of the active disk. Clients are thread
+        safe and pool their connections (``max_pool_connections`` in the disk config).
+        """
+        s3_config = self.disk_config.get('s3')
+        endpoint_url = endpoint_url or s3_config.get('endpoint_url')
+
+        def factory():
+            return boto3.client(
+                's3',
+                aws_access_key_id=s3_config.get('key'),
+                aws_secret_access_key=s3_config.get('secret'),
+                region_name=s3_config.get('region'),
+                endpoint_url=endpoint_url,
+                config=self._client_config(),
+            )
+
+        return adapter_registry.get_or_create(adapter_registry.clients, (self.active_disk, endpoint_url), factory)
+
+    def _client_config(self) -> Config:
+        s3_config = self.disk_config.get('s3')
+        return Config(
+            max_pool_connections=s3_config.get('max_pool_connections', 10),
+            retries={'max_attempts': s3_config.get('max_attempts', 3), 'mode': 'standard'},
+        )
+
     """ def _create_sftp_driver(self):
         #Create SFTP connection.
         try:
@@ -63,7 +516,7 @@ class StorageComponent:
             password = sftp_config.get('password')
             port = sftp_config.get('port', 22)
             
-            self.filesystem[self.active_disk] = SFTPFS(f"sftp://{username}:{password}@{host}:{port}")
+            return SFTPFS(f"sftp://{username}:{password}@{host}:{port}")
         except Exception as exception:
             logging.error(f"Error creating SFTP driver: {exception}") """
 
@@ -76,12 +529,15 @@ class StorageComponent:
             aws_secret_access_key = s3_config.get('secret')
             region = s3_config.get('region')
             
-            # Initialize the S3 filesystem
-            self.filesystem[self.active_disk] = S3FS(
+            # Initialize the S3 filesystem, sharing the disk's pooled client
+            return PooledS3FS(
                 bucket_name=bucket,
                 aws_access_key_id=aws_access_key_id,
                 aws_secret_access_key=aws_secret_access_key,
-                region=region
+                endpoint_url=s3_config.get('endpoint_url'),
+                region=region,
+                client=self.get_client(),
+                client_config=self._client_config()
             )
         except Exception as exception:
             logging.error(f"Error creating S3 driver: {exception}")
@@ -90,55 +546,186 @@ class StorageComponent:
         """Create local filesystem driver."""
         try:
             root = str(Path(self.disk_config.get('root', '/')).resolve())
-            self.filesystem[self.active_disk] = OSFS(root)
+            return OSFS(root, create=self.disk_config.get('create', False))
         except Exception as exception:
             logging.error(f"Error creating local driver: {exception}")
     
-    def write(self, path: str, content):
-        """Store a file in the given filesystem."""
+    def _create_cache_driver(self):
+        """Wrap the adapter of the disk named in the config with a local read cache."""
+        try:
+            remote = StorageComponent().disk(self.disk_config['disk']).get_adapter()
+            if remote is None:
+                return None
+            return CachedFS(
+                remote,
+                OSFS(self.disk_config['root'], create=True),
+                self.disk_config.get('max_size', 512 * 1024 * 1024)
+            )
+        except Exception as exception:
+            logging.error(f"Error creating cache driver: {exception}")
+
+    def cache_stats(self) -> dict:
+        """Hit/miss counters and size of a cache disk, None for other drivers."""
+        adapter = self.get_adapter()
+        return adapter.stats() if isinstance(adapter, CachedFS) else None
+
+    def reading(self):
+        """
+        Disk to read whole stored files of the active disk from. STORAGE_READ_DISKS can
+        point a disk at a cache disk wrapping it (s3 -> s3_cache), repeated reads of the
+        same file (OCR retries, renditions of a shared original) then stay local.
+        """
+        read_disks = getattr(settings, 'STORAGE_READ_DISKS', {})
+        return StorageComponent().disk(read_disks.get(self.active_disk, self.active_disk))
+
+    @timed('write')
+    def write(self, path: str, content, digest=None) -> bool:
+        """
+        Store a file in the given filesystem.
+        :param digest: Optional hashlib object, updated with the bytes as they are streamed
+        """
+        self.forget_signed_url(path)
         try:
+            if self.disk_config.get('driver') == 's3':
+                # Stream S3 uploads as parallel multipart, memory stays bounded by the part size
+                if isinstance(content, str):
+                    content = content.encode()
+                if isinstance(content, bytes):
+                    content = io.BytesIO(content)
+                elif hasattr(content, 'seek'):
+                    content.seek(0)
+                content = HashingReader(content, digest)
+                self.stream_upload(path, content)
+                self._transferred(written=content.size)
+                return True
+
+            if self.disk_config.get('driver') == 'cache':
+                # Write-through: into the cache first, then uploaded from there to the wrapped disk
+                adapter = self.get_adapter()
+                temp_path = adapter.temp_path()
+                with open(temp_path, 'wb') as file:
+                    self._transferred(written=self._write_content(file, content, digest))
+                if not StorageComponent().disk(self.disk_config['disk']).put(temp_path, path):
+                    os.remove(temp_path)
+                    return False
+                adapter.store(path, temp_path)
+                return True
+
             with self.get_adapter().open(path, 'wb') as file:
-                if hasattr(content, 'chunks'):
-                    for chunk in content.chunks():
-                        file.write(chunk)
-                else:
-                    # Ensure content is bytes
-                    if isinstance(content, str):
-                        content = content.encode()
-                    file.write(content)
+                self._transferred(written=self._write_content(file, content, digest))
+            return True
 
         except Exception as exception:
-            logging.error(f"Error storing file '{path}': {exception}")
+            self._log_error(f"Error storing file '{path}': {exception}")
+            return False
+
+    @staticmethod
+    def _write_content(file, content, digest=None) -> int:
+        """Write ``content`` to an open file, returns the number of bytes written."""
+        if hasattr(content, 'chunks'):
+            size = 0
+            for chunk in content.chunks():
+                if digest is not None:
+                    digest.update(chunk)
+                file.write(chunk)
+                size += len(chunk)
+            return size
+
+        # Ensure content is bytes
+        if isinstance(content, str):
+            content = content.encode()
+        if digest is not None:
+            digest.update(content)
+        file.write(content)
+        return len(content)
+
+    def stream_upload(self, path: str, fileobj):
+        """
+        Upload a readable file object to the active S3 disk.
 
+        Objects above ``multipart_threshold`` go up as a multipart upload, read
+        ``multipart_chunksize`` bytes at a time and sent by at most
+        ``multipart_concurrency`` threads, so memory is bounded by
+        chunksize * concurrency whatever the file size. A failed part aborts the
+        multipart upload so no orphaned parts are left in the bucket. Raises on failure.
+        """
+        s3_config = self.disk_config.get('s3')
+        transfer_config = TransferConfig(
+            multipart_threshold=s3_config.get('multipart_threshold', 8 * 1024 * 1024),
+            multipart_chunksize=s3_config.get('multipart_chunksize', 8 * 1024 * 1024),
+            max_concurrency=s3_config.get('multipart_concurrency', 4),
+            use_threads=True,
+        )
+        content_type, _ = mimetypes.guess_type(path)
+        self.get_client().upload_fileobj(
+            fileobj,
+            s3_config.get('bucket'),
+            relpath(normpath(path)),
+            ExtraArgs={'ContentType': content_type or 'binary/octet-stream'},
+            Config=transfer_config,
+        )
 
+    @timed('get')
     def get(self, path: str) -> str:
         """Get the content of a file from the given filesystem."""
         try:
-            return self.get_adapter().readtext(path)
+            content = self.get_adapter().readtext(path)
+            self._transferred(read=len(content.encode()))
+            return content
         except ResourceNotFound:
-            logging.error(f"File '{path}' not found.")
+            self._log_error(f"File '{path}' not found.")
         except Exception as exception:
-            logging.error(f"Error reading file '{path}': {exception}")
+            self._log_error(f"Error reading file '{path}': {exception}")
 
+    @timed('read_bytes')
+    def read_bytes(self, path: str) -> bytes:
+        """Get the content of a file as bytes, None when it cannot be read."""
+        try:
+            content = self.get_adapter().readbytes(path)
+            self._transferred(read=len(content))
+            return content
+        except ResourceNotFound:
+            self._log_error(f"File '{path}' not found.")
+        except Exception as exception:
+            self._log_error(f"Error reading file '{path}': {exception}")
+
+    @timed('download')
+    def download(self, path: str, file) -> bool:
+        """Copy a file into a writable binary file object, without holding all of it in memory."""
+        try:
+            start = file.tell()
+            self.get_adapter().download(path, file)
+            self._transferred(read=file.tell() - start)
+            return True
+        except ResourceNotFound:
+            self._log_error(f"File '{path}' not found.")
+        except Exception as exception:
+            self._log_error(f"Error downloading file '{path}': {exception}")
+        return False
+
+    @timed('remove')
     def remove(self, path: str):
         """Delete a file from the given filesystem."""
+        self.forget_signed_url(path)
         try:
 
             self.get_adapter().remove(path)
         except ResourceNotFound:
-            logging.error(f"File '{path}' not found.")
+            self._log_error(f"File '{path}' not found.")
         except Exception as exception:
-            logging.error(f"Error deleting file '{path}': {exception}")
+            self._log_error(f"Error deleting file '{path}': {exception}")
 
+    @timed('is_exist')
     def is_exist(self, path: str) -> bool:
         """Check if a file exists in the given filesystem."""
         try:
             return self.get_adapter().exists(path)
         except Exception as exception:
-            logging.error(f"Error checking file existence for '{path}': {exception}")
+            self._log_error(f"Error checking file existence for '{path}': {exception}")
             return False
 
-    def put(self, source_path: str, dest_path: str):
+    @timed('put', path_arg=1)
+    def put(self, source_path: str, dest_path: str) -> bool:
         """
         Upload a file from the local filesystem to the given filesystem.
         
@@ -146,12 +733,29 @@ class StorageComponent:
         :param source_path: Path of the file on the local filesystem
         :param dest_path: Path to store the file in the target filesystem
         """
+        self.forget_signed_url(dest_path)
         try:
+            if self.disk_config.get('driver') == 'cache':
+                if not StorageComponent().disk(self.disk_config['disk']).put(source_path, dest_path):
+                    return False
+                adapter = self.get_adapter()
+                temp_path = adapter.temp_path()
+                shutil.copyfile(source_path, temp_path)
+                adapter.store(dest_path, temp_path)
+                return True
+
             with open(source_path, 'rb') as local_file:
-                self.get_adapter().writebytes(dest_path, local_file.read())
+                if self.disk_config.get('driver') == 's3':
+                    self.stream_upload(dest_path, local_file)
+                else:
+                    self.get_adapter().upload(dest_path, local_file)
+            self._transferred(written=os.path.getsize(source_path))
+            return True
         except Exception as exception:
-            logging.error(f"Error uploading file '{source_path}' to '{dest_path}': {exception}")
+            self._log_error(f"Error uploading file '{source_path}' to '{dest_path}': {exception}")
+            return False
 
+    @timed('listing')
     def listing(self, directory: str = "/") -> list:
         """
         List files in the specified directory of the given filesystem.
@@ -164,32 +768,48 @@ class StorageComponent:
         try:
             return self.get_adapter().listdir(directory)
         except ResourceNotFound:
-            logging.error(f"Directory '{directory}' not found.")
+            self._log_error(f"Directory '{directory}' not found.")
             return []
         except Exception as exception:
-            logging.error(f"Error listing directory '{directory}': {exception}")
+            self._log_error(f"Error listing directory '{directory}': {exception}")
             return []
         
+    @timed('move')
     def move(self, src_path: str, dst_path: str, overwrite: bool = False):
+        self.forget_signed_url(src_path)
+        self.forget_signed_url(dst_path)
         try:
             return self.get_adapter().move(src_path, dst_path, overwrite)
         except Exception as exception:
-            logging.error(f"Error moving file '{src_path}' to '{dst_path}': {exception}")
+            self._log_error(f"Error moving file '{src_path}' to '{dst_path}': {exception}")
 
+    @timed('upload_file', path_arg=None)
     def upload_file(self, file, model_instance, collection_name: str = "media") -> bool:
 
         try:
             file_name = file.name
             # Extract file extension, e.g., ".jpg" or ".pdf"
             _, ext = os.path.splitext(file_name)
-            unique_name = f"{hashlib.sha256((str(time.time()) + '-' + str(uuid4())).encode('utf-8')).hexdigest()}{ext}"
-            #unique_name = f"{hashlib.sha256(f"{time.time()}-{uuid4()}".encode('utf-8')).hexdigest()}{ext}"
+
+            if self.is_content_addressed():
+                # Hash the local upload first, known content is never sent again
+                digest = hashlib.sha256()
+                for chunk in file.chunks():
+                    digest.update(chunk)
+                return self._upload_content_addressed(
+                    digest.hexdigest(), ext, file_name, file.content_type, file.size,
+                    model_instance, collection_name, upload=lambda file_path: self.write(file_path, file)
+                )
+
+            unique_name = self._unique_name(ext)
             file_path = f"{collection_name}/{unique_name}"
             file.name = unique_name
             print(file_name, file.name)
 
-            # Upload the file to S3
-            self.write(file_path, file)
+            # Upload the file to S3, nothing is recorded if the upload failed
+            digest = hashlib.sha256()
+            if not self.write(file_path, file, digest=digest):
+                return False
 
             # Upload or insert into Media model
             return Media.upsert(
@@ -199,37 +819,144 @@ class StorageComponent:
                 mime_type=file.content_type,
                 file_size=file.size,
                 disk=self.active_disk,
-                model_instance=model_instance
+                model_instance=model_instance,
+                content_hash=digest.hexdigest()
+            )
+        except Exception as exception:
+            self._log_error(f"{exception}")
+            return False
+
+
+    @timed('upload_local_file', path_arg=None)
+    def upload_local_file(
+            self,
+            source_path: str,
+            file_name: str,
+            mime_type: str,
+            model_instance,
+            collection_name: str = "media",
+            unique_name: str = None,
+            content_hash: str = None
+    ) -> bool:
+        """
+        Upload a file from the local filesystem and record it as the instance's Media.
+        A given ``unique_name`` keeps the object key stable when the upload is retried.
+        On a content-addressed disk ``content_hash`` (sha256 of the file) names the object.
+        """
+        try:
+            _, ext = os.path.splitext(file_name)
+
+            if self.is_content_addressed() and content_hash:
+                return self._upload_content_addressed(
+                    content_hash, ext, file_name, mime_type, os.path.getsize(source_path),
+                    model_instance, collection_name, upload=lambda file_path: self.put(source_path, file_path)
+                )
+
+            unique_name = unique_name or self._unique_name(ext)
+            file_path = f"{collection_name}/{unique_name}"
+
+            if not self.put(source_path, file_path):
+                return False
+
+            return Media.upsert(
+                collection_name=collection_name,
+                file_name=file_name,
+                file_path=file_path,
+                mime_type=mime_type,
+                file_size=os.path.getsize(source_path),
+                disk=self.active_disk,
+                model_instance=model_instance,
+                content_hash=content_hash
             )
         except Exception as exception:
-            logging.error(f"{exception}")
+            self._log_error(f"{exception}")
             return False
 
+    def is_content_addressed(self) -> bool:
+        """Whether the active disk names objects by the sha256 of their bytes."""
+        return bool(self.disk_config and self.disk_config.get('content_addressed'))
+
+    def _upload_content_addressed(
+            self,
+            content_hash: str,
+            ext: str,
+            file_name: str,
+            mime_type: str,
+            file_size: int,
+            model_instance,
+            collection_name: str,
+            upload
+    ) -> bool:
+        """
+        Store the bytes once under ``<collection>/<sha256><ext>`` and point the
+        Media row at the shared blob. ``upload(file_path)`` only runs for content
+        that is not stored yet.
+        """
+        file_path = f"{collection_name}/{content_hash}{ext.lower()}"
+        blob = MediaBlob.acquire(
+            disk=self.active_disk,
+            file_path=file_path,
+            content_hash=content_hash,
+            mime_type=mime_type,
+            size=file_size,
+            upload=lambda: upload(file_path)
+        )
+        if blob is None:
+            return False
+
+        result = Media.upsert(
+            collection_name=collection_name,
+            file_name=file_name,
+            file_path=file_path,
+            mime_type=mime_type,
+            file_size=file_size,
+            disk=self.active_disk,
+            model_instance=model_instance,
+            blob=blob,
+            content_hash=content_hash
+        )
+        if not result:
+            # Give the reference back, an unused blob is taken again by the next upload of the same bytes
+            MediaBlob.release(blob.id)
+        return result
+
+    @staticmethod
+    def _unique_name(ext: str) -> str:
+        """Random object name keeping the file extension."""
+        return f"{hashlib.sha256((str(time.time()) + '-' + str(uuid4())).encode('utf-8')).hexdigest()}{ext}"
 
     def get_public_url(self, file_path: str) -> str:
         """Generate a public URL for the given file."""
         return self.get_adapter().geturl(file_path)
 
-    def generate_signed_url(self, object_name, expiration: int=900):
+    @timed('generate_signed_url')
+    def generate_signed_url(self, object_name, expiration: int=900, verify_exists: bool = True):
         """
         Generate a presigned URL for accessing a file in S3.
+        URLs are cached per (disk, key) until shortly before they expire.
         :param file_path: The S3 key (file path in the bucket)
         :param bucket_name: Name of the S3 bucket
         :param region: AWS region
         :param expiration: URL expiration time in seconds (default 15 minutes)
+        :param verify_exists: Check the object exists first, skip it for keys known to exist (e.g. Media rows)
         :return: Signed URL string
         """
-        if not self.is_exist(object_name):
+        if self.disk_config.get('driver') == 'cache':
+            # Signed URLs point at the wrapped disk
+            return StorageComponent().disk(self.disk_config['disk']).generate_signed_url(
+                object_name, expiration=expiration, verify_exists=verify_exists
+            )
+
+        cache_key = self._signed_url_cache_key(object_name)
+        cached = cache.get(cache_key)
+        if cached and cached['expiration'] == expiration:
+            return cached['url']
+
+        if verify_exists and not self.is_exist(object_name):
             return static('img/not_found.webp')
 
         s3_config = self.disk_config.get('s3')
-        s3_client = boto3.client(
-            's3', 
-            aws_access_key_id=s3_config.get('key'),
-            aws_secret_access_key=s3_config.get('secret'),
-            region_name=s3_config.get('region'),
-            endpoint_url='https://s3.ap-southeast-5.amazonaws.com',
-            )
+        s3_client = self.get_client(endpoint_url=s3_config.get('signing_endpoint_url'))
         try:
             response = s3_client.generate_presigned_url(
                 'get_object',
@@ -239,9 +966,63 @@ class StorageComponent:
                 },
                 ExpiresIn=expiration
             )
+            # Drop the cached URL well before S3 would reject it
+            timeout = expiration - max(expiration // 10, 30)
+            if timeout > 0:
+                cache.set(cache_key, {'url': response, 'expiration': expiration}, timeout)
             return response
         except ClientError as exception:
-            logging.error(f"Could not generate signed URL: {exception}")
+            self._log_error(f"Could not generate signed URL: {exception}")
             return None
 
+    def forget_signed_url(self, object_name: str):
+        """Invalidate the cached signed URL of a key that is being written or removed."""
+        cache.delete(self._signed_url_cache_key(object_name))
+
+    @staticmethod
+    def _log_error(message: str):
+        """Log a swallowed error, counting it against the call in progress."""
+        logging.error(message)
+        call = _current_call.get()
+        if call is not None:
+            call.error = True
+
+    @staticmethod
+    def _transferred(read: int = 0, written: int = 0):
+        """Count bytes moved by the call in progress."""
+        call = _current_call.get()
+        if call is not None:
+            call.read += read
+            call.written += written
+
+    def metrics(self) -> dict:
+        """Series of the metrics exporter for the active disk, ``{operation: {...}}``, when it keeps them in memory."""
+        exporter = get_metrics_exporter()
+        if not isinstance(exporter, InMemoryExporter):
+            return None
+        return {operation: series for (disk, operation), series in exporter.snapshot().items() if disk == self.active_disk}
+
+    def _signed_url_cache_key(self, object_name: str) -> str:
+        disk = self.active_disk
+        if self.disk_config and self.disk_config.get('driver') == 'cache':
+            disk = self.disk_config['disk']
+        digest = hashlib.sha256(f"{disk}:{object_name}".encode('utf-8')).hexdigest()
+        return f"storage:signed_url:{digest}"
+
+    # Async API, for async views under ASGI. The blocking storage I/O runs in a
+    # worker thread (thread_sensitive=False) so the event loop keeps serving other
+    # requests while S3 answers, ORM writes stay on Django's sync thread.
+
+    async def awrite(self, path: str, content, digest=None) -> bool:
+        return await sync_to_async(self.write, thread_sensitive=False)(path, content, digest=digest)
+
+    async def aremove(self, path: str):
+        return await sync_to_async(self.remove, thread_sensitive=False)(path)
+
+    async def ais_exist(self, path: str) -> bool:
+        return await sync_to_async(self.is_exist, thread_sensitive=False)(path)
 
+    async def agenerate_signed_url(self, object_name, expiration: int = 900, verify_exists: bool = True):
+        return await sync_to_async(self.generate_signed_url, thread_sensitive=False)(
+            object_name, expiration=expiration, verify_exists=verify_exists
+        )
@@ -1,4 +1,7 @@
 import os
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
 
 config = {
     "disks": {
@@ -6,15 +9,37 @@ config = {
             "driver": "local",
             "root": "/"
         },
+        "staging": {
+            # Uploads wait here for the job worker, must be shared with the workers' hosts
+            "driver": "local",
+            "root": os.getenv("STORAGE_STAGING_ROOT", str(BASE_DIR / "storage" / "staging")),
+            "create": True
+        },
         "s3": {
             "driver": "s3",
+            # Name objects by the sha256 of their bytes, identical uploads share one object
+            "content_addressed": os.getenv("S3_CONTENT_ADDRESSED", "false").lower() == "true",
             "s3": {
                 "bucket": os.getenv("S3_BUCKET", "default-bucket-name"),
                 "key": os.getenv("S3_KEY", ""),
                 "secret": os.getenv("S3_SECRET", ""),
-                "region": os.getenv("S3_REGION", "ap-southeast-1")  # Provide a default region if necessary
+                "region": os.getenv("S3_REGION", "ap-southeast-1"),  # Provide a default region if necessary
+                "endpoint_url": os.getenv("S3_ENDPOINT_URL") or None,  # e.g. a local S3 stand-in
+                "signing_endpoint_url": os.getenv("S3_SIGNING_ENDPOINT_URL") or "https://s3.ap-southeast-5.amazonaws.com",
+                "max_pool_connections": int(os.getenv("S3_MAX_POOL_CONNECTIONS", 10)),  # Connections kept per client
+                "max_attempts": int(os.getenv("S3_MAX_ATTEMPTS", 3)),
+                "multipart_threshold": int(os.getenv("S3_MULTIPART_THRESHOLD", 8 * 1024 * 1024)),  # Bytes before switching to multipart
+                "multipart_chunksize": int(os.getenv("S3_MULTIPART_CHUNKSIZE", 8 * 1024 * 1024)),  # Part size in bytes
+                "multipart_concurrency": int(os.getenv("S3_MULTIPART_CONCURRENCY", 4))  # Parts uploaded in parallel
             }
         },
+        "s3_cache": {
+            # Read-through cache of the s3 disk on local disk, least recently read files are evicted first
+            "driver": "cache",
+            "disk": "s3",
+            "root": os.getenv("STORAGE_CACHE_ROOT", str(BASE_DIR / "storage" / "cache")),
+            "max_size": int(os.getenv("STORAGE_CACHE_MAX_SIZE", 512 * 1024 * 1024))  # Bytes
+        },
         "sftp_disk": {
             "driver": "sftp",
             "sftp": {
@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+from django.utils.module_loading import autodiscover_modules
+
+
+class JobConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'modules.job'
+
+    def ready(self):
+        # Handlers live in a jobs.py module of each app
+        autodiscover_modules('jobs')
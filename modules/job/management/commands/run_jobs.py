@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from modules.job.queue import run_next
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (storage uploads, removals, ...)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the queue once and exit.")
+        parser.add_argument('--sleep', type=float, default=1.0, help="Seconds to wait when the queue is empty.")
+
+    def handle(self, *args, **options):
+        self.stdout.write("Job worker started.")
+        try:
+            while True:
+                close_old_connections()
+                if run_next():
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write("Job worker stopped.")
@@ -0,0 +1,36 @@
+from django.db import models
+from django.utils import timezone
+
+
+# Create your models here.
+class Job(models.Model):
+    """
+    Unit of background work, stored in the database so it survives restarts.
+    Picked up by the ``run_jobs`` management command.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = 'pending'
+        RUNNING = 'running'
+        DONE = 'done'
+        FAILED = 'failed'
+
+    name = models.CharField(max_length=191)
+    payload = models.JSONField(default=dict, blank=True)
+    idempotency_key = models.CharField(max_length=191, unique=True)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    available_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='job_status_available_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
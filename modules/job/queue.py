@@ -0,0 +1,118 @@
+import logging
+from datetime import timedelta
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from modules.job.models import Job
+
+handlers = {}
+
+
+def register(name: str):
+    """Decorator registering ``func(payload)`` as the handler of jobs called ``name``."""
+    def decorator(func):
+        handlers[name] = func
+        return func
+    return decorator
+
+
+def enqueue(name: str, payload: dict, idempotency_key: str = None, delay: int = 0, max_attempts: int = 5) -> Job:
+    """
+    Queue a job. Enqueuing twice with the same ``idempotency_key`` returns the
+    existing job instead of creating a second one.
+
+    Called inside ``transaction.atomic()`` the job row commits or rolls back
+    together with the caller's writes, so a worker never sees a job for work
+    that did not commit.
+    """
+    job, _ = Job.objects.get_or_create(
+        idempotency_key=idempotency_key or f"{name}:{uuid4().hex}",
+        defaults={
+            'name': name,
+            'payload': payload,
+            'max_attempts': max_attempts,
+            'available_at': timezone.now() + timedelta(seconds=delay),
+        }
+    )
+    return job
+
+
+def claim_next() -> Job:
+    """Lock and return the next due job, or None when the queue is empty."""
+    now = timezone.now()
+    lease = timedelta(seconds=getattr(settings, 'JOB_LEASE_SECONDS', 300))
+
+    with transaction.atomic():
+        # A job still RUNNING past its lease belongs to a worker that died. Put it back, unless it
+        # used up its attempts: a job that kills its worker every time (e.g. out of memory) stops there
+        expired = Job.objects.filter(status=Job.Status.RUNNING, locked_until__lt=now)
+        expired.filter(attempts__gte=F('max_attempts')).update(
+            status=Job.Status.FAILED, locked_until=None, last_error="Worker stopped before the job finished.", updated_at=now
+        )
+        expired.update(status=Job.Status.PENDING)
+
+        job = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=Job.Status.PENDING, available_at__lte=now)
+            .order_by('available_at', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+
+        job.status = Job.Status.RUNNING
+        job.attempts += 1
+        job.locked_until = now + lease
+        job.save(update_fields=['status', 'attempts', 'locked_until', 'updated_at'])
+        return job
+
+
+def run_job(job: Job) -> bool:
+    """
+    Run a claimed job, scheduling a retry with exponential backoff when it fails.
+    The outcome is only written while this worker still holds the lease, a job
+    that outlived its lease was handed to another worker and is theirs now.
+    """
+    lease = job.locked_until
+    try:
+        handler = handlers[job.name]
+        handler(job.payload)
+    except Exception as exception:
+        logging.error(f"Job {job.id} '{job.name}' failed (attempt {job.attempts}): {exception}")
+        job.last_error = str(exception)
+        job.locked_until = None
+        if job.attempts < job.max_attempts:
+            job.status = Job.Status.PENDING
+            job.available_at = timezone.now() + timedelta(seconds=2 ** job.attempts)
+        else:
+            job.status = Job.Status.FAILED
+        finish(job, lease, ['status', 'available_at', 'locked_until', 'last_error'])
+        return False
+
+    job.status = Job.Status.DONE
+    job.locked_until = None
+    return finish(job, lease, ['status', 'locked_until'])
+
+
+def finish(job: Job, lease, fields: list) -> bool:
+    """Write ``fields`` of a job that ran, unless its lease ``lease`` was lost meanwhile."""
+    job.updated_at = timezone.now()
+    updated = Job.objects.filter(pk=job.pk, status=Job.Status.RUNNING, locked_until=lease).update(
+        **{field: getattr(job, field) for field in fields + ['updated_at']}
+    )
+    if not updated:
+        logging.warning(f"Job {job.id} '{job.name}' lost its lease while running, outcome not recorded.")
+    return bool(updated)
+
+
+def run_next() -> bool:
+    """Claim and run one job. Returns False when there was nothing to do."""
+    job = claim_next()
+    if job is None:
+        return False
+    run_job(job)
+    return True
@@ -0,0 +1,104 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from modules.job.models import Job
+from modules.job.queue import claim_next, enqueue, handlers, register, run_job, run_next
+
+calls = []
+
+
+@register('test.record')
+def record(payload: dict):
+    calls.append(payload)
+
+
+@register('test.fail')
+def fail(payload: dict):
+    raise Exception("boom")
+
+
+class JobQueueTest(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueue_is_idempotent(self):
+        first = enqueue('test.record', {'n': 1}, idempotency_key='same')
+        second = enqueue('test.record', {'n': 2}, idempotency_key='same')
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(Job.objects.count(), 1)
+        self.assertEqual(Job.objects.get().payload, {'n': 1})
+
+    def test_runs_due_jobs_only(self):
+        enqueue('test.record', {'n': 1}, delay=60)
+        self.assertFalse(run_next())
+        enqueue('test.record', {'n': 2})
+        self.assertTrue(run_next())
+        self.assertEqual(calls, [{'n': 2}])
+        self.assertEqual(Job.objects.get(payload={'n': 2}).status, Job.Status.DONE)
+
+    def test_failure_is_retried_with_backoff(self):
+        job = enqueue('test.fail', {}, max_attempts=2)
+
+        before = timezone.now()
+        self.assertTrue(run_next())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.PENDING)
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(job.last_error, "boom")
+        self.assertGreaterEqual(job.available_at, before + timedelta(seconds=2))
+        self.assertIsNone(job.locked_until)
+
+        # Not due yet
+        self.assertFalse(run_next())
+
+        Job.objects.filter(pk=job.pk).update(available_at=timezone.now())
+        run_next()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.FAILED)
+        self.assertEqual(job.attempts, 2)
+
+    def test_expired_lease_is_reclaimed(self):
+        job = enqueue('test.record', {'n': 1})
+        claimed = claim_next()
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertIsNone(claim_next(), "a leased job is not handed out twice")
+
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        reclaimed = claim_next()
+        self.assertEqual(reclaimed.pk, job.pk)
+        self.assertEqual(reclaimed.attempts, 2)
+
+    def test_job_that_keeps_killing_its_worker_fails(self):
+        job = enqueue('test.record', {'n': 1}, max_attempts=2)
+        for attempt in (1, 2):
+            claimed = claim_next()
+            self.assertEqual((claimed.pk, claimed.attempts), (job.pk, attempt))
+            # The worker dies, its lease runs out
+            Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+
+        self.assertIsNone(claim_next())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.FAILED)
+        self.assertIsNone(job.locked_until)
+        self.assertEqual(calls, [])
+
+    def test_worker_that_lost_its_lease_does_not_overwrite_the_outcome(self):
+        enqueue('test.fail', {})
+        stale = claim_next()
+        Job.objects.filter(pk=stale.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+
+        handlers['test.fail'], original = record, handlers['test.fail']
+        try:
+            current = claim_next()
+            self.assertTrue(run_job(current))
+        finally:
+            handlers['test.fail'] = original
+
+        # The first worker finishes late and fails
+        self.assertFalse(run_job(stale))
+        job = Job.objects.get(pk=stale.pk)
+        self.assertEqual(job.status, Job.Status.DONE)
+        self.assertEqual(job.last_error, '')
@@ -0,0 +1,248 @@
+import hashlib
+import os
+from uuid import uuid4
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+
+from components.ocr_component import get_ocr_pool
+from components.storage_component import StorageComponent
+from modules.job.queue import enqueue, register
+from modules.media.models import Media, MediaBlob, MediaText, validate_file_size
+
+STAGING_DISK = 'staging'
+
+
+def queue_upload(file, model_instance, collection_name: str = "media", disk: str = "s3"):
+    """
+    Stage an uploaded file on local disk and queue its upload to ``disk``.
+    The request returns right away, the job worker uploads the file, records the
+    Media row and removes the file it replaces.
+    """
+    validate_file_size(file.size)
+
+    _, ext = os.path.splitext(file.name)
+    staging_name = f"{uuid4().hex}{ext}"
+    # Hash while staging, a content-addressed disk names the object after it
+    digest = hashlib.sha256()
+    if not StorageComponent().disk(STAGING_DISK).write(staging_name, file, digest=digest):
+        raise Exception("Could not store the uploaded file, please try again.")
+
+    return enqueue(
+        'media.upload',
+        {
+            'staging_name': staging_name,
+            'file_name': file.name,
+            'mime_type': file.content_type,
+            'collection_name': collection_name,
+            'disk': disk,
+            'content_type_id': ContentType.objects.get_for_model(model_instance).id,
+            'object_id': model_instance.id,
+            'content_hash': digest.hexdigest(),
+        },
+        idempotency_key=f"media.upload:{staging_name}"
+    )
+
+
+def queue_remove(media: Media, replaced_by: str = None):
+    """
+    Queue removal of a Media file and of its renditions, call it in the transaction deleting the row.
+    A file shared through a MediaBlob is only removed once its last reference is released.
+    :param replaced_by: path of the file replacing this one, renditions made from that same file are kept
+    """
+    for rendition in media.renditions.all():
+        if replaced_by is None or rendition.custom_properties.get('source_path') != replaced_by:
+            queue_remove(rendition)
+
+    if media.blob_id:
+        blob = MediaBlob.release(media.blob_id)
+        if blob is None:
+            return None
+        return enqueue(
+            'media.remove',
+            {'disk': blob.disk, 'path': blob.file_path, 'blob': True},
+            # A blob taken back by a new upload can be released again, by this same row too
+            idempotency_key=f"media.remove:blob:{blob.id}:{media.id}:{media.updated_at.isoformat()}"
+        )
+
+    return enqueue(
+        'media.remove',
+        {'disk': media.disk or 's3', 'path': media.file_path},
+        idempotency_key=f"media.remove:{media.id}:{media.file_path}"
+    )
+
+
+def queue_ocr(media: Media):
+    """Queue text extraction of a stored image, once per save of its Media row."""
+    return enqueue(
+        'media.ocr',
+        {'media_id': media.id, 'file_path': media.file_path},
+        # A content-addressed re-upload keeps the path, the save time tells the uploads apart
+        idempotency_key=f"media.ocr:{media.id}:{media.file_path}:{media.updated_at.isoformat()}"
+    )
+
+
+def queue_renditions(media: Media):
+    """Queue generation of the WebP renditions of a stored image, once per save of its Media row."""
+    return enqueue(
+        'media.renditions',
+        {'media_id': media.id, 'file_path': media.file_path},
+        idempotency_key=f"media.renditions:{media.id}:{media.file_path}:{media.updated_at.isoformat()}"
+    )
+
+
+@register('media.upload')
+def upload(payload: dict):
+    staging = StorageComponent().disk(STAGING_DISK)
+    if not staging.is_exist(payload['staging_name']):
+        # Already uploaded by an earlier attempt
+        return
+
+    content_type = ContentType.objects.get_for_id(payload['content_type_id'])
+    model_instance = content_type.model_class().objects.filter(pk=payload['object_id']).first()
+    if model_instance is None:
+        # Owner was deleted before the upload ran
+        staging.remove(payload['staging_name'])
+        return
+
+    storage = StorageComponent().disk(payload['disk'])
+    # The new row, its blob reference and the removal of the file it replaces commit together.
+    # A worker dying in between rolls all of them back, the retry then still sees the old row as previous.
+    with transaction.atomic():
+        previous = Media.objects.select_for_update().for_instance(model_instance).first()
+
+        is_uploaded = storage.upload_local_file(
+            staging.get_adapter().getsyspath(payload['staging_name']),
+            file_name=payload['file_name'],
+            mime_type=payload['mime_type'],
+            model_instance=model_instance,
+            collection_name=payload['collection_name'],
+            unique_name=payload['staging_name'],
+            content_hash=payload.get('content_hash')
+        )
+        if not is_uploaded:
+            raise Exception(f"Uploading '{payload['file_name']}' failed.")
+
+        if previous:
+            current = Media.objects.filter(pk=previous.pk).values_list('file_path', flat=True).first()
+            # A shared blob always gives back the old reference, release() keeps it while still in use
+            if previous.blob_id or previous.file_path != current:
+                # The same bytes uploaded again keep their path, and with it their renditions
+                queue_remove(previous, replaced_by=current)
+            if not payload['mime_type'].startswith('image/'):
+                # No renditions job runs for the new file, those of the image it replaces go now
+                for rendition in previous.renditions.all():
+                    queue_remove(rendition)
+                    rendition.delete()
+
+    # Only once committed, a retry finding the staged file uploads it again under the same key
+    staging.remove(payload['staging_name'])
+
+
+@register('media.remove')
+def remove(payload: dict):
+    storage = StorageComponent().disk(payload['disk'])
+    # The blob row stays locked until the object is gone, an upload of the same bytes
+    # waits for it in MediaBlob.acquire() and then stores them again
+    with transaction.atomic():
+        blob = MediaBlob.objects.select_for_update().filter(disk=payload['disk'], file_path=payload['path']).first()
+        if blob is not None and blob.ref_count > 0:
+            # The same content was uploaded again after its removal was queued
+            return
+        if blob is None and payload.get('blob'):
+            # Removed by an earlier attempt
+            return
+
+        if storage.is_exist(payload['path']):
+            storage.remove(payload['path'])
+        if blob is not None:
+            blob.delete()
+
+
+@register('media.ocr')
+def ocr(payload: dict):
+    media = Media.objects.filter(pk=payload['media_id'], file_path=payload['file_path']).first()
+    if media is None:
+        # File was replaced or deleted before the job ran
+        return
+
+    content_hash = media.custom_properties.get('content_hash')
+    text = MediaText.objects.filter(content_hash=content_hash).first() if content_hash else None
+    if text is not None:
+        lines = text.lines
+    else:
+        pool = get_ocr_pool()
+        # Failures raise, the job is retried instead of caching an empty result
+        lines = pool.submit_file(media.disk or 's3', media.file_path, wait=pool.timeout).result(timeout=pool.timeout or None)
+        if content_hash:
+            MediaText.objects.get_or_create(content_hash=content_hash, defaults={'lines': lines})
+
+    # update() skips post_save, and leaves the row alone if another upload replaced the file meanwhile
+    Media.objects.filter(pk=media.pk, file_path=media.file_path).update(
+        custom_properties={**media.custom_properties, 'ocr': lines}
+    )
+
+
+@register('media.renditions')
+def renditions(payload: dict):
+    media = Media.objects.filter(pk=payload['media_id'], file_path=payload['file_path']).first()
+    if media is None:
+        # File was replaced or deleted before the job ran
+        return
+
+    storage = StorageComponent().disk(media.disk or 's3')
+    content = storage.reading().read_bytes(media.file_path)
+    if content is None:
+        raise Exception(f"Could not read '{media.file_path}'.")
+    image = cv2.imdecode(np.frombuffer(content, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise Exception(f"Could not decode '{media.file_path}'.")
+
+    height, width = image.shape[:2]
+    existing = {rendition.collection_name: rendition for rendition in media.renditions.all()}
+    directory, file_name = os.path.split(media.file_path)
+    stem, _ = os.path.splitext(file_name)
+
+    for name, max_side in settings.MEDIA_RENDITIONS.items():
+        previous = existing.get(name)
+        scale = max_side / max(width, height)
+        if scale >= 1:
+            # The original is already small enough, browsers get it instead
+            if previous:
+                queue_remove(previous)
+                previous.delete()
+            continue
+
+        resized = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        is_encoded, encoded = cv2.imencode('.webp', resized, [cv2.IMWRITE_WEBP_QUALITY, settings.MEDIA_RENDITION_QUALITY])
+        if not is_encoded:
+            raise Exception(f"Could not encode the {name} of '{media.file_path}'.")
+
+        # Named after the owning row, content-addressed originals are shared but renditions are not
+        file_path = f"{directory}/{stem}-{media.id}-{name}.webp"
+        if not storage.write(file_path, encoded.tobytes()):
+            raise Exception(f"Storing the {name} of '{media.file_path}' failed.")
+
+        Media.objects.update_or_create(
+            content_type=ContentType.objects.get_for_model(Media),
+            object_id=media.id,
+            collection_name=name,
+            defaults={
+                'file_name': f"{stem}-{name}.webp",
+                'file_path': file_path,
+                'mime_type': 'image/webp',
+                'size': encoded.size,
+                'disk': media.disk,
+                'custom_properties': {
+                    'width': resized.shape[1],
+                    'height': resized.shape[0],
+                    'source_path': media.file_path,
+                    'source_width': width,
+                },
+            }
+        )
+        if previous and previous.file_path != file_path:
+            queue_remove(previous)
@@ -0,0 +1,161 @@
+import json
+import os
+import resource
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from components.ocr_component import OcrComponent
+from modules.media.models import Media, MediaText
+
+
+def current_rss(pid='self') -> int:
+    """Resident memory of a process in bytes."""
+    try:
+        with open(f'/proc/{pid}/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        if pid != 'self':
+            # Exited meanwhile, or no procfs to read another process from
+            return 0
+        # No procfs (macOS), fall back to the peak, reported in bytes there
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Command(BaseCommand):
+    help = "Extract the text of stored images that have none yet (Media.custom_properties['ocr'])."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--collection', default='data_entry_task', help="Media collection to backfill.")
+        parser.add_argument('--chunk-size', type=int, default=100, help="Rows fetched, read and written per batch.")
+        parser.add_argument('--workers', type=int, default=None, help="OCR processes, defaults to OCR_WORKERS.")
+        parser.add_argument(
+            '--checkpoint',
+            default=str(settings.BASE_DIR / 'storage' / 'ocr_backfill.json'),
+            help="File recording the last processed Media id and the failed ones, a new run resumes after it and retries them."
+        )
+        parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint and start from the first row.")
+        parser.add_argument(
+            '--max-rss', type=int, default=None,
+            help="Stop after the current batch once this process and its OCR workers use more than this many MB "
+                 "(workers are only counted where /proc is available)."
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = max(options['chunk_size'], 1)
+        last_id, failed_ids = (0, []) if options['restart'] else self.read_checkpoint(options['checkpoint'])
+
+        pending = Media.objects.filter(collection_name=options['collection'], mime_type__startswith='image/').exclude(
+            custom_properties__has_key='ocr'
+        )
+        # Rows that failed on an earlier run are retried, unless they got their text or were deleted meanwhile
+        failed_ids = set(pending.filter(id__in=failed_ids).values_list('id', flat=True))
+        queryset = (
+            pending.filter(Q(id__gt=last_id) | Q(id__in=failed_ids))
+            .only('id', 'file_path', 'disk', 'custom_properties')
+            .order_by('id')
+        )
+        total = queryset.count()
+        self.stdout.write(
+            f"{total} images without text in '{options['collection']}', resuming after id {last_id}, "
+            f"retrying {len(failed_ids)} failed."
+        )
+
+        # Every row of a batch is in flight at once, workers fetch from storage and OCR concurrently
+        pool = OcrComponent(workers=options['workers'], queue_size=chunk_size)
+        started = time.monotonic()
+        done = failed = 0
+        rows = queryset.iterator(chunk_size=chunk_size)
+        try:
+            while True:
+                batch = list(islice(rows, chunk_size))
+                if not batch:
+                    break
+
+                written, errors = self.process(pool, batch)
+                done += written
+                failed += len(errors)
+                # Retried rows sort before the checkpoint, it never moves back
+                last_id = max(last_id, batch[-1].id)
+                failed_ids = (failed_ids - {media.id for media in batch}) | set(errors)
+                self.write_checkpoint(options['checkpoint'], last_id, failed_ids)
+
+                elapsed = time.monotonic() - started
+                rate = (done + failed) / elapsed if elapsed else 0
+                remaining = (total - done - failed) / rate if rate else 0
+                self.stdout.write(
+                    f"{done + failed}/{total} ({failed} failed), {rate:.2f} images/s, "
+                    f"~{remaining / 60:.1f} min left, last id {last_id}"
+                )
+
+                rss = current_rss() + sum(current_rss(pid) for pid in pool.worker_pids())
+                if options['max_rss'] and rss > options['max_rss'] * 1024 * 1024:
+                    self.stdout.write(self.style.WARNING(
+                        f"Memory above {options['max_rss']} MB, stopping. Run again to resume after id {last_id}."
+                    ))
+                    break
+        finally:
+            pool.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {done} images written, {failed} failed, the next run retries the {len(failed_ids)} recorded in the checkpoint."
+        ))
+
+    def process(self, pool: OcrComponent, batch: list) -> tuple[int, list]:
+        """OCR one batch and write the results with a single bulk update, returns (written, failed ids)."""
+        hashes = {media.custom_properties.get('content_hash') for media in batch} - {None}
+        known = dict(MediaText.objects.filter(content_hash__in=hashes).values_list('content_hash', 'lines'))
+
+        futures = {}
+        for media in batch:
+            if media.custom_properties.get('content_hash') not in known:
+                futures[media.id] = pool.submit_file(media.disk or 's3', media.file_path, wait=pool.timeout)
+
+        # Skip rows whose file was replaced while the batch ran, the upload queued its own OCR
+        current = dict(Media.objects.filter(pk__in=[media.id for media in batch]).values_list('id', 'file_path'))
+
+        updated, texts, failed = [], [], []
+        for media in batch:
+            content_hash = media.custom_properties.get('content_hash')
+            if media.id in futures:
+                try:
+                    lines = futures[media.id].result(timeout=pool.timeout or None)
+                except Exception as exception:
+                    self.stderr.write(f"Media {media.id} '{media.file_path}': {exception}")
+                    failed.append(media.id)
+                    continue
+                if content_hash:
+                    texts.append(MediaText(content_hash=content_hash, lines=lines))
+                    known[content_hash] = lines
+            else:
+                lines = known[content_hash]
+
+            if current.get(media.id) != media.file_path:
+                continue
+            media.custom_properties = {**media.custom_properties, 'ocr': lines}
+            updated.append(media)
+
+        MediaText.objects.bulk_create(texts, ignore_conflicts=True)
+        Media.objects.bulk_update(updated, ['custom_properties'])
+        return len(updated), failed
+
+    @staticmethod
+    def read_checkpoint(path: str) -> tuple[int, list]:
+        """Last processed id and the ids that failed up to it."""
+        try:
+            with open(path) as file:
+                checkpoint = json.load(file)
+            return int(checkpoint.get('last_id', 0)), [int(media_id) for media_id in checkpoint.get('failed', [])]
+        except (OSError, ValueError, TypeError, AttributeError):
+            return 0, []
+
+    @staticmethod
+    def write_checkpoint(path: str, last_id: int, failed_ids: set):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # Written aside and renamed, an interrupted run never leaves a half written checkpoint
+        with open(f"{path}.tmp", 'w') as file:
+            json.dump({'last_id': last_id, 'failed': sorted(failed_ids)}, file)
+        os.replace(f"{path}.tmp", path)
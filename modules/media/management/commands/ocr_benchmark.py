@@ -0,0 +1,77 @@
+import difflib
+import os
+import time
+
+import cv2
+from django.core.management.base import BaseCommand, CommandError
+
+from components.ocr_component import _init_worker, get_preprocessing, image_dpi, recognize
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp', '.webp')
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare OCR with the preprocessing pipeline against plain grayscale. "
+        "The corpus is a directory of scans, each with the expected text in a .txt file of the same name."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('corpus', help="Directory with the sample scans and their .txt transcripts.")
+        parser.add_argument('--repeat', type=int, default=1, help="Runs per image, the fastest one is kept.")
+        parser.add_argument('--timeout', type=float, default=60, help="Seconds Tesseract may spend on one image.")
+
+    def handle(self, *args, **options):
+        samples = self.load_corpus(options['corpus'])
+        pipeline = get_preprocessing()
+        modes = {
+            'grayscale': {**pipeline, 'enabled': False},
+            'pipeline': {**pipeline, 'enabled': True},
+        }
+
+        _init_worker(os.getenv('TESSERACT_CMD_PATH', r'C:\Program Files\Tesseract-OCR\tesseract.exe'))
+
+        for mode, preprocessing in modes.items():
+            seconds, scores = 0.0, []
+            for name, image, dpi, expected in samples:
+                best, lines = None, []
+                for _ in range(max(options['repeat'], 1)):
+                    started = time.perf_counter()
+                    lines = recognize(image, options['timeout'], preprocessing, dpi)
+                    elapsed = time.perf_counter() - started
+                    best = elapsed if best is None else min(best, elapsed)
+                seconds += best
+                scores.append(self.accuracy(expected, '\n'.join(lines)))
+                self.stdout.write(f"  {mode:<10} {name:<40} {best:7.2f}s  accuracy {scores[-1]:.3f}")
+
+            self.stdout.write(self.style.SUCCESS(
+                f"{mode}: {len(samples) / seconds:.2f} images/s, "
+                f"mean accuracy {sum(scores) / len(scores):.3f} over {len(samples)} images"
+            ))
+
+    def load_corpus(self, directory: str) -> list[tuple]:
+        if not os.path.isdir(directory):
+            raise CommandError(f"Corpus directory '{directory}' not found.")
+
+        samples = []
+        for file_name in sorted(os.listdir(directory)):
+            base, ext = os.path.splitext(file_name)
+            transcript = os.path.join(directory, f"{base}.txt")
+            if ext.lower() not in IMAGE_EXTENSIONS or not os.path.exists(transcript):
+                continue
+            path = os.path.join(directory, file_name)
+            image = cv2.imread(path, cv2.IMREAD_COLOR)
+            if image is None:
+                self.stderr.write(f"Skipping '{file_name}', it could not be decoded.")
+                continue
+            with open(transcript, encoding='utf-8') as file:
+                samples.append((file_name, image, image_dpi(path), file.read()))
+
+        if not samples:
+            raise CommandError("No scans with a matching .txt transcript in the corpus directory.")
+        return samples
+
+    @staticmethod
+    def accuracy(expected: str, actual: str) -> float:
+        """Character similarity (0-1) of the two texts, whitespace collapsed."""
+        return difflib.SequenceMatcher(None, ' '.join(expected.split()), ' '.join(actual.split())).ratio()
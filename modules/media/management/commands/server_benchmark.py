@@ -0,0 +1,163 @@
+import asyncio
+import io
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from auditlog.context import disable_auditlog
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.utils import timezone
+
+from components.storage_component import adapter_registry
+from modules.media.management.mock_s3 import mock_s3
+from modules.media.models import Media
+from modules.task.models import Task
+
+
+class Command(BaseCommand):
+    help = (
+        "Throughput of the task views (the update page, which signs its attachment, alternating with the "
+        "datatable rows) served by Django's WSGI handler on a pool of worker threads against its ASGI handler "
+        "on one event loop whose executor gets the same number of threads. Benchmark tasks are deleted "
+        "afterwards. Signing needs S3 credentials, pass --mock to use moto in process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Requests per server model.")
+        parser.add_argument('--threads', type=int, default=4, help="Worker threads of both server models.")
+        parser.add_argument('--concurrency', type=int, default=50, help="Requests in flight on the ASGI event loop.")
+        parser.add_argument('--mock', action='store_true', help="Use moto's in-process S3 mock (needs moto).")
+
+    def handle(self, *args, **options):
+        with mock_s3(options['mock']):
+            adapter_registry.clear()
+            host = 'localhost' if not settings.ALLOWED_HOSTS or '*' in settings.ALLOWED_HOSTS else settings.ALLOWED_HOSTS[0].lstrip('.')
+
+            client = Client()
+            client.force_login(User.objects.get_or_create(username='server-benchmark')[0])
+            cookie = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+
+            runs = (
+                (f"WSGI ({options['threads']} threads)",
+                 lambda paths: self.wsgi_load(paths, options['threads'], host, cookie)),
+                (f"ASGI ({options['threads']} threads, {options['concurrency']} in flight)",
+                 lambda paths: asyncio.run(self.asgi_load(paths, options['threads'], options['concurrency'], host, cookie))),
+            )
+            task_ids = []
+            try:
+                for label, run in runs:
+                    # Fresh tasks for every run, an opened task stays leased to the benchmark user
+                    tasks = self.seed(max(options['requests'], 1))
+                    task_ids += tasks
+                    paths = [
+                        f"/task/task_update/{task_id}/" if index % 2 == 0 else "/task/dt_task?draw=1&start=0&length=10"
+                        for index, task_id in enumerate(tasks)
+                    ]
+
+                    started = time.perf_counter()
+                    statuses = run(paths)
+                    elapsed = time.perf_counter() - started
+
+                    failed = sum(status != 200 for status in statuses)
+                    self.stdout.write(f"{label:<36} {len(paths) / elapsed:8.1f} requests/s  {failed} failed")
+            finally:
+                self.cleanup(task_ids)
+
+    @staticmethod
+    def seed(count: int) -> list:
+        """Tasks with an image attachment on the s3 disk, the update page signs its URL."""
+        with disable_auditlog():
+            task_ids = [
+                Task.objects.create(
+                    title=f"Server benchmark task {index}", source="benchmark",
+                    content="benchmark", published=timezone.now()
+                ).id
+                for index in range(count)
+            ]
+        # Bulk insert, the post_save signals would queue OCR and renditions of files that do not exist
+        Media.objects.bulk_create([
+            Media(
+                collection_name="data_entry_task", file_name="benchmark.png",
+                file_path=f"data_entry_task/server-benchmark-{task_id}.png", mime_type="image/png", size=1,
+                content_type=ContentType.objects.get_for_model(Task), object_id=task_id, disk='s3',
+                custom_properties={'ocr': []}
+            )
+            for task_id in task_ids
+        ])
+        return task_ids
+
+    @staticmethod
+    def cleanup(task_ids: list):
+        Media.objects.for_instances(task_ids, model=Task).delete()
+        with disable_auditlog():
+            Task.objects.filter(id__in=task_ids).delete()
+
+    @staticmethod
+    def wsgi_load(paths: list, threads: int, host: str, cookie: str) -> list:
+        handler = WSGIHandler()
+
+        def request(path):
+            path, _, query = path.partition('?')
+            environ = {
+                'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '', 'PATH_INFO': path, 'QUERY_STRING': query,
+                'SERVER_NAME': host, 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'REMOTE_ADDR': '127.0.0.1',
+                'HTTP_HOST': host, 'HTTP_COOKIE': cookie,
+                'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+                'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+            }
+            status = []
+            response = handler(environ, lambda line, headers, exc_info=None: status.append(int(line.split()[0])))
+            try:
+                for _ in response:
+                    pass
+            finally:
+                # Fires request_finished, which closes the thread's database connection like a real server
+                response.close()
+            return status[0]
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            return list(executor.map(request, paths))
+
+    @staticmethod
+    async def asgi_load(paths: list, threads: int, concurrency: int, host: str, cookie: str) -> list:
+        # The views' storage calls (thread_sensitive=False) run on the loop's executor, the ORM on Django's sync thread
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=threads))
+        handler = ASGIHandler()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def request(path):
+            path, _, query = path.partition('?')
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+                'path': path, 'raw_path': path.encode(), 'root_path': '', 'query_string': query.encode(),
+                'headers': [(b'host', host.encode()), (b'cookie', cookie.encode())],
+                'client': ('127.0.0.1', 0), 'server': (host, 80),
+            }
+            body = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+            finished = asyncio.Event()
+
+            async def receive():
+                if body:
+                    return body.pop()
+                # The client stays connected, the handler stops listening once the response is sent
+                await finished.wait()
+                return {'type': 'http.disconnect'}
+
+            status = []
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+
+            async with semaphore:
+                await handler(scope, receive, send)
+            finished.set()
+            return status[0]
+
+        return await asyncio.gather(*(request(path) for path in paths))
@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from components.storage_component import StorageComponent, adapter_registry
+from modules.media.management.mock_s3 import mock_s3
+
+
+class Command(BaseCommand):
+    help = (
+        "Per-request latency of the s3 disk with adapters and boto3 clients rebuilt on every request "
+        "(how task_update/task_delete used to run) against the shared registry. Point S3_ENDPOINT_URL at "
+        "a local S3 stand-in (moto server, MinIO), or pass --mock to use moto in process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Requests timed per mode.")
+        parser.add_argument('--mock', action='store_true', help="Use moto's in-process S3 mock (needs moto).")
+        parser.add_argument('--key', default='benchmark/object.txt', help="Object written once and then checked and signed.")
+
+    def handle(self, *args, **options):
+        with mock_s3(options['mock']):
+            adapter_registry.clear()
+            if not StorageComponent().disk('s3').write(options['key'], b'benchmark'):
+                raise CommandError("Could not write to the s3 disk, check S3_ENDPOINT_URL and the credentials.")
+
+            for mode in ('per-request', 'shared'):
+                timings = []
+                for _ in range(max(options['requests'], 1)):
+                    if mode == 'per-request':
+                        # A brand new S3FS and boto3 client, like before the registry
+                        adapter_registry.clear()
+                    started = time.perf_counter()
+                    self.request(options['key'])
+                    timings.append(time.perf_counter() - started)
+
+                timings.sort()
+                self.stdout.write(
+                    f"{mode:<12} mean {sum(timings) / len(timings) * 1000:7.2f} ms  "
+                    f"p50 {timings[len(timings) // 2] * 1000:7.2f} ms  "
+                    f"p95 {timings[int(len(timings) * 0.95) - 1] * 1000:7.2f} ms"
+                )
+
+            storage = StorageComponent().disk('s3')
+            storage.get_client().delete_object(Bucket=storage.disk_config['s3']['bucket'], Key=options['key'])
+
+    @staticmethod
+    def request(key: str):
+        """What task_update does with the s3 disk: check the attachment and sign its URL."""
+        storage = StorageComponent().disk('s3')
+        storage.forget_signed_url(key)
+        storage.is_exist(key)
+        storage.generate_signed_url(key, verify_exists=False)
@@ -0,0 +1,30 @@
+import contextlib
+
+import boto3
+from django.core.management.base import CommandError
+
+from config.storage import config
+
+
+@contextlib.contextmanager
+def mock_s3(enabled: bool):
+    """
+    moto's in-process S3 with the s3 disk's bucket created, for the --mock option
+    of the benchmark commands. Does nothing when not enabled.
+    """
+    if not enabled:
+        yield
+        return
+
+    try:
+        from moto import mock_aws
+    except ImportError:
+        raise CommandError("--mock needs moto installed.")
+
+    with mock_aws():
+        s3_config = config['disks']['s3']['s3']
+        boto3.client('s3', region_name=s3_config['region']).create_bucket(
+            Bucket=s3_config['bucket'],
+            CreateBucketConfiguration={'LocationConstraint': s3_config['region']}
+        )
+        yield
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.5 on 2026-10-18 16:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0003_alter_media_size'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('disk', models.CharField(max_length=191)),
+                ('file_path', models.CharField(max_length=255)),
+                ('content_hash', models.CharField(db_index=True, max_length=64)),
+                ('mime_type', models.CharField(max_length=100)),
+                ('size', models.PositiveBigIntegerField()),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('disk', 'file_path'), name='media_blob_disk_file_path_unique')],
+            },
+        ),
+        migrations.AddField(
+            model_name='media',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='media', to='media.mediablob'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-18 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('media', '0005_mediatext'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='media',
+            index=models.Index(fields=['content_type', 'object_id', 'collection_name'], name='media_owner_collection_idx'),
+        ),
+    ]
@@ -1,8 +1,9 @@
 # media_manager/models.py
-from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 
 
 def validate_file_size(value):
@@ -14,6 +15,122 @@ def validate_file_size(value):
             params={'value': value}
         )
 
+class MediaBlob(models.Model):
+    """
+    Stored object shared by every Media row with the same bytes (content-addressed disks).
+    ``ref_count`` is the number of Media rows pointing at it, the object is removed
+    from storage when it drops to zero.
+    """
+    disk = models.CharField(max_length=191)
+    file_path = models.CharField(max_length=255)
+    content_hash = models.CharField(max_length=64, db_index=True)
+    mime_type = models.CharField(max_length=100)
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['disk', 'file_path'], name='media_blob_disk_file_path_unique'),
+        ]
+
+    def __str__(self):
+        return self.file_path
+
+    def acquire(
+            disk: str,
+            file_path: str,
+            content_hash: str,
+            mime_type: str,
+            size: int,
+            upload
+    ):
+        """
+        Take a reference on the blob stored at ``file_path``. ``upload()`` is only
+        called when the blob is not stored yet, it must return True on success.
+        Returns the blob, or None when the upload failed.
+        """
+        with transaction.atomic():
+            blob = MediaBlob.objects.select_for_update().filter(disk=disk, file_path=file_path).first()
+            if blob is not None:
+                blob.ref_count = F('ref_count') + 1
+                blob.save(update_fields=['ref_count'])
+                blob.refresh_from_db(fields=['ref_count'])
+                return blob
+
+        # Upload outside the transaction, S3 can be slow
+        if not upload():
+            return None
+
+        with transaction.atomic():
+            blob, created = MediaBlob.objects.select_for_update().get_or_create(
+                disk=disk,
+                file_path=file_path,
+                defaults={'content_hash': content_hash, 'mime_type': mime_type, 'size': size, 'ref_count': 1}
+            )
+            if not created:
+                blob.ref_count = F('ref_count') + 1
+                blob.save(update_fields=['ref_count'])
+                blob.refresh_from_db(fields=['ref_count'])
+            return blob
+
+    def release(blob_id: int):
+        """
+        Drop one reference. Returns the blob when nothing references it anymore,
+        the caller then queues the removal of the stored object. The row stays at
+        zero references until that removal, which deletes it under the same lock
+        ``acquire()`` takes, so the same bytes uploaded meanwhile are never lost.
+        """
+        with transaction.atomic():
+            blob = MediaBlob.objects.select_for_update().filter(pk=blob_id).first()
+            if blob is None:
+                return None
+            if blob.ref_count > 0:
+                blob.ref_count = F('ref_count') - 1
+                blob.save(update_fields=['ref_count'])
+                blob.refresh_from_db(fields=['ref_count'])
+            return blob if blob.ref_count == 0 else None
+
+
+class MediaQuerySet(models.QuerySet):
+
+    def for_instance(self, instance, collection_name: str = None):
+        """Media attached to one model instance."""
+        return self.for_instances([instance.pk], model=type(instance), collection_name=collection_name)
+
+    def for_instances(self, instances, model=None, collection_name: str = None):
+        """
+        Media attached to many instances of one model, in a single query.
+
+        :param instances: queryset, list of instances, or list of primary keys (then ``model`` is required)
+        :param model: model of the instances, taken from them when not given
+        """
+        if isinstance(instances, models.QuerySet):
+            model = model or instances.model
+            object_ids = instances.values('pk')
+        else:
+            instances = list(instances)
+            if instances and isinstance(instances[0], models.Model):
+                model = model or type(instances[0])
+                object_ids = [instance.pk for instance in instances]
+            else:
+                object_ids = instances
+        if model is None:
+            raise ValueError("for_instances() needs a model when given primary keys.")
+
+        queryset = self.filter(content_type=ContentType.objects.get_for_model(model), object_id__in=object_ids)
+        if collection_name is not None:
+            queryset = queryset.filter(collection_name=collection_name)
+        return queryset
+
+    def attached_ids(self, instances, model=None, collection_name: str = None) -> set:
+        """Primary keys of the given instances that have at least one Media."""
+        return set(
+            self.for_instances(instances, model=model, collection_name=collection_name)
+            .values_list('object_id', flat=True).distinct()
+        )
+
+
 class Media(models.Model):
     collection_name = models.CharField(max_length=255) 
     file_name = models.CharField(max_length=255)
@@ -27,9 +144,28 @@ class Media(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     disk = models.CharField(max_length=191, null=True)
+    blob = models.ForeignKey(MediaBlob, null=True, blank=True, on_delete=models.SET_NULL, related_name='media')
+    # Derived images (thumbnail, preview), Media rows owned by this one, deleted with it
+    renditions = GenericRelation('self')
+
+    objects = MediaQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Every lookup goes through the owner (generic relation), optionally narrowed to a collection
+            models.Index(fields=['content_type', 'object_id', 'collection_name'], name='media_owner_collection_idx'),
+        ]
 
     def __str__(self):
         return self.file_name
+
+    @property
+    def is_rendition(self) -> bool:
+        return self.content_type_id == ContentType.objects.get_for_model(Media).id
+
+    @property
+    def is_image(self) -> bool:
+        return bool(self.mime_type) and self.mime_type.startswith('image/')
     
     def upsert(
             collection_name: str,
@@ -38,7 +174,9 @@ class Media(models.Model):
             mime_type: str,
             file_size: int,
             disk: str,
-            model_instance
+            model_instance,
+            blob: MediaBlob = None,
+            content_hash: str = None
     ) -> bool:
         try:
             # Validate the file size
@@ -47,6 +185,14 @@ class Media(models.Model):
             # Get the ContentType for the model instance
             content_type = ContentType.objects.get_for_model(model_instance)
 
+            # Properties of the replaced file do not carry over, text already read from the same bytes does
+            custom_properties = {}
+            if content_hash:
+                custom_properties['content_hash'] = content_hash
+                text = MediaText.objects.filter(content_hash=content_hash).first()
+                if text is not None:
+                    custom_properties['ocr'] = text.lines
+
             # Perform the upsert operation
             return Media.objects.update_or_create(
                 content_type=content_type,
@@ -58,6 +204,8 @@ class Media(models.Model):
                     'mime_type': mime_type,
                     'disk': disk,
                     'size': file_size,
+                    'blob': blob,
+                    'custom_properties': custom_properties,
                 }
             )
 
@@ -66,3 +214,13 @@ class Media(models.Model):
             print(f"Error during upsert: {e}")
             # Return False on failure
             return False
+
+
+class MediaText(models.Model):
+    """OCR result of an image, keyed by the sha256 of its bytes so identical uploads reuse it."""
+    content_hash = models.CharField(max_length=64, unique=True)
+    lines = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.content_hash
@@ -0,0 +1,21 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from modules.media.jobs import queue_ocr, queue_renditions
+from modules.media.models import Media
+
+
+@receiver(post_save, sender=Media)
+def schedule_ocr(sender, instance, **kwargs):
+    """Queue OCR of a newly stored image, its text is kept in custom_properties."""
+    if instance.is_rendition:
+        return
+    if instance.mime_type.startswith('image/') and 'ocr' not in instance.custom_properties:
+        queue_ocr(instance)
+
+
+@receiver(post_save, sender=Media)
+def schedule_renditions(sender, instance, **kwargs):
+    """Queue the thumbnail and preview of a newly stored image."""
+    if instance.mime_type.startswith('image/') and not instance.is_rendition:
+        queue_renditions(instance)
@@ -1,3 +1,393 @@
-from django.test import TestCase
+import copy
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import Future
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+from PIL import Image
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from components.ocr_component import ReusableBuffer, get_preprocessing, image_dpi, preprocess, recognize
+from components.storage_component import StorageComponent, adapter_registry, get_metrics_exporter
+from config.storage import config
+from modules.job.models import Job
+from modules.job.queue import run_next
+from modules.media.jobs import queue_remove, queue_upload
+from modules.media.models import Media, MediaBlob, MediaText
+from modules.task.models import Task
+
+
+class LocalStorageTestCase(TestCase):
+    """Staging and a 'test' disk in a temporary directory, jobs run in the test."""
+
+    content_addressed = False
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.disks = copy.deepcopy(config['disks'])
+        config['disks']['staging'] = {'driver': 'local', 'root': f"{self.root}/staging", 'create': True}
+        config['disks']['test'] = {
+            'driver': 'local', 'root': f"{self.root}/test", 'create': True, 'content_addressed': self.content_addressed,
+        }
+        adapter_registry.clear()
+        self.storage = StorageComponent().disk('test')
+        self.storage.get_adapter().makedirs('docs', recreate=True)
+        self.task = Task.objects.create(title='Task', source='source', content='content', published=timezone.now())
+
+    def tearDown(self):
+        config['disks'] = self.disks
+        adapter_registry.clear()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def upload(self, content: bytes, name: str = 'notes.txt', task: Task = None, mime_type: str = 'text/plain'):
+        queue_upload(
+            SimpleUploadedFile(name, content, content_type=mime_type),
+            model_instance=task or self.task, collection_name='docs', disk='test'
+        )
+        self.run_jobs()
+        return Media.objects.for_instance(task or self.task).first()
+
+    @staticmethod
+    def run_jobs():
+        while run_next():
+            pass
+
+    def stored(self) -> list:
+        return sorted(self.storage.listing('docs'))
+
+
+class UploadJobTest(LocalStorageTestCase):
+
+    def test_upload_stores_file_and_records_media(self):
+        media = self.upload(b'hello')
+        self.assertEqual(media.disk, 'test')
+        self.assertEqual(self.storage.get_adapter().readbytes(media.file_path), b'hello')
+        self.assertEqual(StorageComponent().disk('staging').listing('/'), [])
+
+    def test_replacing_a_file_removes_the_previous_one(self):
+        first = self.upload(b'first')
+        second = self.upload(b'second')
+        self.assertEqual(first.pk, second.pk)
+        self.assertNotEqual(first.file_path, second.file_path)
+        self.assertEqual(self.stored(), [second.file_path.split('/')[-1]])
+
+    def test_crash_before_the_removal_is_queued_rolls_the_upload_back(self):
+        first = self.upload(b'first')
+        with mock.patch('modules.media.jobs.queue_remove', side_effect=RuntimeError("worker died")):
+            self.upload(b'second')
+        self.assertEqual(Media.objects.get().file_path, first.file_path)
+
+        # The retry still replaces the first file
+        Job.objects.filter(status=Job.Status.PENDING).update(available_at=timezone.now())
+        self.run_jobs()
+        second = Media.objects.get()
+        self.assertNotEqual(second.file_path, first.file_path)
+        self.assertEqual(self.stored(), [second.file_path.split('/')[-1]])
+        self.assertEqual(StorageComponent().disk('staging').listing('/'), [])
+
+    def test_remove_job_deletes_the_file(self):
+        media = self.upload(b'hello')
+        queue_remove(media)
+        media.delete()
+        self.run_jobs()
+        self.assertEqual(self.stored(), [])
+
+    @override_settings(STORAGE_READ_DISKS={'test': 'test_cache'})
+    def test_reads_go_through_the_read_disk(self):
+        config['disks']['test_cache'] = {'driver': 'cache', 'disk': 'test', 'root': f"{self.root}/cache"}
+        media = self.upload(b'hello')
+
+        reader = self.storage.reading()
+        self.assertEqual(reader.active_disk, 'test_cache')
+        for _ in range(2):
+            self.assertEqual(reader.get_adapter().readbytes(media.file_path), b'hello')
+        self.assertEqual(reader.cache_stats()['misses'], 1)
+        self.assertEqual(reader.cache_stats()['hits'], 1)
+
+    def test_reads_are_timed_with_their_bytes(self):
+        media = self.upload(b'hello')
+        get_metrics_exporter().reset()
+
+        self.assertEqual(self.storage.read_bytes(media.file_path), b'hello')
+        buffer = ReusableBuffer()
+        self.assertTrue(self.storage.download(media.file_path, buffer))
+        self.assertIsNone(self.storage.read_bytes('docs/missing.txt'))
+
+        metrics = self.storage.metrics()
+        self.assertEqual((metrics['read_bytes']['count'], metrics['read_bytes']['read'], metrics['read_bytes']['errors']), (2, 5, 1))
+        self.assertEqual((metrics['download']['count'], metrics['download']['read']), (1, 5))
+
+    def test_upload_for_a_deleted_owner_is_dropped(self):
+        task = Task.objects.create(title='Gone', source='source', content='content', published=timezone.now())
+        queue_upload(SimpleUploadedFile('a.txt', b'a', content_type='text/plain'), model_instance=task, collection_name='docs', disk='test')
+        task.delete()
+        self.run_jobs()
+        self.assertEqual(self.stored(), [])
+        self.assertEqual(StorageComponent().disk('staging').listing('/'), [])
+
+
+class ContentAddressedTest(LocalStorageTestCase):
+
+    content_addressed = True
+
+    def setUp(self):
+        super().setUp()
+        self.other = Task.objects.create(title='Other', source='source', content='content', published=timezone.now())
+
+    def remove(self, media: Media):
+        queue_remove(media)
+        media.delete()
+
+    def test_identical_uploads_share_one_blob(self):
+        first = self.upload(b'same bytes')
+        second = self.upload(b'same bytes', task=self.other)
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual(first.file_path, second.file_path)
+        self.assertEqual(MediaBlob.objects.get().ref_count, 2)
+        self.assertEqual(self.stored(), [first.file_path.split('/')[-1]])
+
+    def test_file_is_removed_when_the_last_reference_goes(self):
+        first = self.upload(b'same bytes')
+        second = self.upload(b'same bytes', task=self.other)
+
+        self.remove(first)
+        self.run_jobs()
+        self.assertEqual(MediaBlob.objects.get().ref_count, 1)
+        self.assertEqual(len(self.stored()), 1)
+
+        self.remove(second)
+        self.run_jobs()
+        self.assertFalse(MediaBlob.objects.exists())
+        self.assertEqual(self.stored(), [])
+
+    def test_upload_after_a_queued_removal_keeps_the_file(self):
+        media = self.upload(b'same bytes')
+        self.remove(media)
+        self.assertEqual(MediaBlob.objects.get().ref_count, 0)
+
+        # Uploaded again before the worker got to the removal
+        source = f"{self.root}/again.txt"
+        with open(source, 'wb') as file:
+            file.write(b'same bytes')
+        self.assertTrue(self.storage.upload_local_file(
+            source, file_name='again.txt', mime_type='text/plain', model_instance=self.other,
+            collection_name='docs', content_hash=hashlib.sha256(b'same bytes').hexdigest()
+        ))
+        self.run_jobs()
+
+        self.assertEqual(MediaBlob.objects.get().ref_count, 1)
+        self.assertEqual(self.stored(), [media.file_path.split('/')[-1]])
+
+    def test_blob_is_removed_under_its_row_lock(self):
+        media = self.upload(b'same bytes')
+        self.remove(media)
+
+        original_remove = StorageComponent.remove
+
+        def remove(storage, path):
+            # An upload of the same bytes now waits in MediaBlob.acquire() until the object and its row are gone
+            self.assertTrue(MediaBlob.objects.filter(file_path=path, ref_count=0).exists())
+            original_remove(storage, path)
+
+        with mock.patch.object(StorageComponent, 'remove', autospec=True, side_effect=remove):
+            self.run_jobs()
+
+        self.assertFalse(MediaBlob.objects.exists())
+        self.assertEqual(self.stored(), [])
+
+    def test_blob_released_again_after_a_reupload_is_removed(self):
+        media = self.upload(b'same bytes')
+        self.upload(b'other bytes')
+        self.upload(b'same bytes')
+        self.upload(b'other bytes')
+        self.run_jobs()
+
+        # The same row let go of the same blob twice, both removals ran
+        self.assertEqual(list(MediaBlob.objects.values_list('file_path', flat=True)), [Media.objects.get().file_path])
+        self.assertEqual(self.stored(), [Media.objects.get().file_path.split('/')[-1]])
+        self.assertNotEqual(Media.objects.get().file_path, media.file_path)
+
+
+class OcrJobTest(LocalStorageTestCase):
+
+    content_addressed = True
+
+    def setUp(self):
+        super().setUp()
+        # Smaller than every rendition, only the OCR job runs
+        self.image = cv2.imencode('.png', np.zeros((10, 10, 3), np.uint8))[1].tobytes()
+        patcher = mock.patch('modules.media.jobs.get_ocr_pool')
+        self.pool = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.pool.submit_file.return_value.result.return_value = ['first line']
+
+    def test_text_is_stored_on_the_media(self):
+        media = self.upload(self.image, 'scan.png', mime_type='image/png')
+        self.assertEqual(media.custom_properties['ocr'], ['first line'])
+        self.assertEqual(MediaText.objects.get().lines, ['first line'])
+
+    def test_same_bytes_uploaded_again_keep_their_text(self):
+        first = self.upload(self.image, 'scan.png', mime_type='image/png')
+        second = self.upload(self.image, 'again.png', mime_type='image/png')
+        self.assertEqual(first.file_path, second.file_path)
+        self.assertEqual(second.custom_properties['ocr'], ['first line'])
+        self.assertEqual(self.pool.submit_file.call_count, 1)
+
+
+class OcrPreprocessingTest(TestCase):
+
+    @staticmethod
+    def encode(dpi=None) -> bytes:
+        file = io.BytesIO()
+        Image.new('RGB', (400, 200), 'white').save(file, 'PNG', **({'dpi': (dpi, dpi)} if dpi else {}))
+        return file.getvalue()
+
+    def page_width(self, content: bytes) -> int:
+        image = cv2.imdecode(np.frombuffer(content, np.uint8), cv2.IMREAD_COLOR)
+        page, _ = preprocess(image, {**get_preprocessing(), 'deskew': False, 'regions': False}, image_dpi(io.BytesIO(content)))
+        return page.shape[1]
+
+    def test_resolution_is_read_from_the_file(self):
+        self.assertAlmostEqual(image_dpi(io.BytesIO(self.encode(600))), 600, places=0)
+        self.assertIsNone(image_dpi(io.BytesIO(self.encode())))
+
+        buffer = ReusableBuffer()
+        buffer.write(self.encode(600))
+        buffer.seek(0)
+        self.assertAlmostEqual(image_dpi(buffer), 600, places=0)
+
+    def test_only_scans_above_the_target_are_downscaled(self):
+        self.assertEqual(self.page_width(self.encode(600)), 200)
+        self.assertEqual(self.page_width(self.encode(150)), 400)
+        # Unknown resolution, kept at its size
+        self.assertEqual(self.page_width(self.encode()), 400)
+
+
+class OcrDeadlineTest(TestCase):
+
+    def recognize(self, timeout: float, seconds_per_region: float) -> list:
+        """Timeouts the regions were read with, one worker reading four regions."""
+        self.timeouts = []
+
+        def tesseract(crop, timeout=0, config=''):
+            self.timeouts.append(timeout)
+            time.sleep(seconds_per_region)
+            return 'line'
+
+        page = np.zeros((10, 40), np.uint8)
+        with mock.patch('components.ocr_component.preprocess', return_value=(page, [(x, 0, 10, 10) for x in range(0, 40, 10)])), \
+                mock.patch('components.ocr_component._tesseract', side_effect=tesseract):
+            recognize(page, timeout, {**get_preprocessing(), 'region_workers': 1})
+        return self.timeouts
+
+    def test_regions_share_the_timeout(self):
+        timeouts = self.recognize(1, 0.05)
+        self.assertEqual(len(timeouts), 4)
+        self.assertLessEqual(timeouts[0], 1)
+        self.assertEqual(timeouts, sorted(timeouts, reverse=True))
+        self.assertLess(timeouts[-1], 1 - 0.15)
+
+    def test_remaining_regions_are_skipped_past_the_deadline(self):
+        with self.assertRaisesMessage(RuntimeError, "timeout"):
+            self.recognize(0.1, 0.15)
+        self.assertEqual(len(self.timeouts), 1)
+
+    def test_no_timeout_means_no_limit(self):
+        self.assertEqual(self.recognize(0, 0), [0, 0, 0, 0])
+
+
+class OcrBackfillTest(TestCase):
+
+    def setUp(self):
+        self.checkpoint = f"{tempfile.mkdtemp()}/checkpoint.json"
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.checkpoint))
+        task = Task.objects.create(title='Task', source='source', content='content', published=timezone.now())
+        self.media = [
+            Media.objects.create(
+                collection_name='data_entry_task', file_name=f'{index}.png', file_path=f'data_entry_task/{index}.png',
+                mime_type='image/png', size=1, content_type=ContentType.objects.get_for_model(Task), object_id=task.id,
+            )
+            for index in range(4)
+        ]
+        self.broken = {self.media[1].file_path}
+
+    def submit_file(self, disk, path, **kwargs):
+        future = Future()
+        if path in self.broken:
+            future.set_exception(RuntimeError("unreadable"))
+        else:
+            future.set_result([path])
+        return future
+
+    def backfill(self):
+        with mock.patch('modules.media.management.commands.ocr_backfill.OcrComponent') as component:
+            pool = component.return_value
+            pool.timeout = 1
+            pool.submit_file.side_effect = self.submit_file
+            pool.worker_pids.return_value = []
+            call_command('ocr_backfill', checkpoint=self.checkpoint, chunk_size=2, stdout=io.StringIO(), stderr=io.StringIO())
+        return pool
+
+    def test_failed_rows_are_retried_on_the_next_run(self):
+        self.backfill()
+        with open(self.checkpoint) as file:
+            self.assertEqual(json.load(file), {'last_id': self.media[-1].id, 'failed': [self.media[1].id]})
+        self.assertNotIn('ocr', Media.objects.get(pk=self.media[1].id).custom_properties)
+
+        self.broken.clear()
+        pool = self.backfill()
+        self.assertEqual([call.args[1] for call in pool.submit_file.call_args_list], [self.media[1].file_path])
+        self.assertEqual(Media.objects.get(pk=self.media[1].id).custom_properties['ocr'], [self.media[1].file_path])
+        with open(self.checkpoint) as file:
+            self.assertEqual(json.load(file)['failed'], [])
+
+
+class RenditionJobTest(LocalStorageTestCase):
+
+    content_addressed = True
+
+    def setUp(self):
+        super().setUp()
+        # Wider than the thumbnail, narrower than the preview
+        self.image = cv2.imencode('.png', np.zeros((200, 400, 3), np.uint8))[1].tobytes()
+        patcher = mock.patch('modules.media.jobs.get_ocr_pool')
+        patcher.start().return_value.submit_file.return_value.result.return_value = []
+        self.addCleanup(patcher.stop)
+
+    def test_thumbnail_is_generated(self):
+        media = self.upload(self.image, 'scan.png', mime_type='image/png')
+        thumbnail = media.renditions.get()
+        self.assertEqual(thumbnail.collection_name, 'thumbnail')
+        self.assertEqual(thumbnail.custom_properties['width'], 320)
+        self.assertEqual(self.stored(), sorted([media.file_path.split('/')[-1], thumbnail.file_path.split('/')[-1]]))
+
+    def test_same_bytes_uploaded_again_keep_their_renditions(self):
+        first = self.upload(self.image, 'scan.png', mime_type='image/png')
+        second = self.upload(self.image, 'again.png', mime_type='image/png')
+        self.assertEqual(first.file_path, second.file_path)
+
+        thumbnail = second.renditions.get()
+        self.assertEqual(thumbnail.custom_properties['source_path'], second.file_path)
+        self.assertTrue(self.storage.is_exist(thumbnail.file_path))
+
+    def test_image_replaced_by_another_file_loses_its_renditions(self):
+        media = self.upload(self.image, 'scan.png', mime_type='image/png')
+        self.assertTrue(media.renditions.exists())
+
+        replaced = self.upload(b'notes', 'notes.txt')
+        self.run_jobs()
+
+        self.assertEqual(replaced.pk, media.pk)
+        self.assertFalse(replaced.renditions.exists())
+        self.assertEqual(self.stored(), [replaced.file_path.split('/')[-1]])
@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class TaskConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'modules.task'
+
+    def ready(self):
+        from modules.task import signals
+        from modules.task.audit import buffer_audit_log
+        from modules.task.models import Task
+
+        buffer_audit_log(Task)
+
+        post_migrate.connect(signals.install_search_index, sender=self)
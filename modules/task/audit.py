@@ -0,0 +1,158 @@
+import contextlib
+from contextvars import ContextVar
+
+from auditlog.diff import model_instance_diff
+from auditlog.models import LogEntry, LogEntryManager
+from auditlog.receivers import check_disable
+from auditlog import receivers
+from auditlog.registry import auditlog
+from auditlog.signals import post_log, pre_log
+from django.conf import settings
+from django.core import serializers
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.utils import timezone
+
+from modules.job.queue import enqueue, register
+
+# Log entries of the innermost audit_batch() of this thread / task, None outside of one
+_entries = ContextVar('audit_entries', default=None)
+
+
+class BufferedLogEntryManager(LogEntryManager):
+    """
+    ``LogEntry.objects.log_create`` that keeps the entry in the open batch
+    instead of inserting it, and inserts right away outside of a batch.
+    """
+
+    def create(self, **kwargs):
+        entries = _entries.get()
+        if entries is None:
+            return super().create(**kwargs)
+
+        entry = self.model(**kwargs)
+        entry.timestamp = timezone.now()
+        # bulk_create sends no pre_save, this is how AuditlogMiddleware fills in the actor and remote address
+        pre_save.send(sender=self.model, instance=entry, raw=False, using=self.db, update_fields=None)
+        entries.append(entry)
+        return entry
+
+
+log_entries = BufferedLogEntryManager()
+log_entries.model = LogEntry
+
+
+@contextlib.contextmanager
+def audit_batch(using=None):
+    """
+    ``transaction.atomic()`` that collects the audit log entries of the saves
+    and deletes inside it and writes them with one bulk insert (or one job, see
+    AUDITLOG_SINK) just before the block commits. The entries commit together
+    with the changes they describe, or roll back with them.
+
+    Nested batches join the outer one, entries of a nested batch that raised are dropped.
+    """
+    entries = _entries.get()
+    if entries is not None:
+        mark = len(entries)
+        try:
+            with transaction.atomic(using=using):
+                yield
+        except BaseException:
+            del entries[mark:]
+            raise
+        return
+
+    entries = []
+    token = _entries.set(entries)
+    try:
+        with transaction.atomic(using=using):
+            yield
+            _entries.reset(token)
+            token = None
+            flush(entries)
+    finally:
+        if token is not None:
+            _entries.reset(token)
+
+
+def flush(entries: list):
+    """Write buffered entries, inline or through the job worker depending on AUDITLOG_SINK."""
+    if not entries:
+        return
+    if getattr(settings, 'AUDITLOG_SINK', 'bulk') == 'job':
+        # The job row commits in the caller's transaction, the worker inserts the entries later
+        enqueue('audit.write', {'entries': serializers.serialize('json', entries)})
+    else:
+        LogEntry.objects.bulk_create(entries)
+
+
+@register('audit.write')
+def write_entries(payload: dict):
+    entries = [deserialized.object for deserialized in serializers.deserialize('json', payload['entries'])]
+    LogEntry.objects.bulk_create(entries)
+
+
+def _create_log_entry(action, instance, sender, diff_old, diff_new, fields_to_check=None, force_log=False):
+    """Same as auditlog's, creating the entry through ``log_entries``."""
+    pre_log_results = pre_log.send(sender, instance=instance, action=action)
+    if any(result[1] is False for result in pre_log_results):
+        return
+
+    error = None
+    log_entry = None
+    changes = None
+    try:
+        changes = model_instance_diff(diff_old, diff_new, fields_to_check=fields_to_check)
+        if force_log or changes:
+            log_entry = log_entries.log_create(instance, action=action, changes=changes, force_log=force_log)
+    except BaseException as exception:
+        error = exception
+    finally:
+        if log_entry or error:
+            post_log.send(
+                sender,
+                instance=instance,
+                instance_old=diff_old,
+                action=action,
+                error=error,
+                pre_log_results=pre_log_results,
+                changes=changes,
+                log_entry=log_entry,
+                log_created=log_entry is not None,
+            )
+        if error:
+            raise error
+
+
+@check_disable
+def log_create(sender, instance, created, **kwargs):
+    if created:
+        _create_log_entry(LogEntry.Action.CREATE, instance, sender, None, instance)
+
+
+@check_disable
+def log_update(sender, instance, **kwargs):
+    if not instance._state.adding:
+        old = sender.objects.filter(pk=instance.pk).first()
+        _create_log_entry(LogEntry.Action.UPDATE, instance, sender, old, instance, kwargs.get('update_fields'))
+
+
+@check_disable
+def log_delete(sender, instance, **kwargs):
+    if instance.pk is not None:
+        _create_log_entry(LogEntry.Action.DELETE, instance, sender, instance, None)
+
+
+def buffer_audit_log(model):
+    """
+    Swap auditlog's receivers of a registered model for the batching ones
+    above. The registration (and its field config) stays as it is.
+    """
+    for signal, default, buffered in (
+        (post_save, receivers.log_create, log_create),
+        (pre_save, receivers.log_update, log_update),
+        (post_delete, receivers.log_delete, log_delete),
+    ):
+        signal.disconnect(sender=model, dispatch_uid=auditlog._dispatch_uid(signal, default))
+        signal.connect(buffered, sender=model, dispatch_uid=f"audit_batch.{buffered.__name__}.{model._meta.label}")
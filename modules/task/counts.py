@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from modules.task.models import Task
+
+TOTAL_COUNT_CACHE_KEY = 'task:count:total'
+
+
+def get_total_count() -> int:
+    """
+    Return the number of tasks from the cache, counting only on a miss.
+    The cached value is adjusted by the Task signals and expires after
+    TASK_COUNT_CACHE_TIMEOUT seconds so bulk writes without signals heal.
+    """
+    total = cache.get(TOTAL_COUNT_CACHE_KEY)
+    if total is None:
+        total = Task.objects.count()
+        cache.set(TOTAL_COUNT_CACHE_KEY, total, getattr(settings, 'TASK_COUNT_CACHE_TIMEOUT', 300))
+    return total
+
+
+def adjust_total_count(delta: int):
+    """Shift the cached total once the current transaction commits."""
+    def apply():
+        try:
+            cache.incr(TOTAL_COUNT_CACHE_KEY, delta)
+        except ValueError:
+            # Not cached yet, the next read will count
+            pass
+
+    transaction.on_commit(apply)
+
+
+def count_filtered(queryset) -> tuple[int, bool]:
+    """
+    Count a filtered queryset.
+
+    With TASK_COUNT_APPROXIMATE_THRESHOLD set, counting stops after that many
+    rows and the threshold is returned as an approximate count.
+
+    :return: (count, is_approximate)
+    """
+    threshold = getattr(settings, 'TASK_COUNT_APPROXIMATE_THRESHOLD', None)
+    if not threshold:
+        return queryset.count(), False
+
+    # COUNT(*) over a LIMITed subquery, the database stops scanning at threshold + 1
+    capped = queryset.order_by().values('id')[:threshold + 1].count()
+    if capped > threshold:
+        return threshold, True
+    return capped, False
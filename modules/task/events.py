@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+class TaskEventBroker:
+    """
+    Fan-out of task change events to the open event streams.
+
+    ``publish`` is called from request threads, ``subscribe`` is consumed by the
+    async SSE view. A deployment with several workers points TASK_EVENT_BROKER
+    at a subclass backed by a shared channel (e.g. Redis pub/sub) so that an
+    event published by one worker reaches the streams held by the others.
+    """
+
+    def publish(self, event: dict):
+        raise NotImplementedError
+
+    def subscribe(self, keepalive: float = None):
+        """
+        Return an async iterator of events. When ``keepalive`` is given, None is
+        yielded after that many idle seconds so the caller can ping the client.
+        """
+        raise NotImplementedError
+
+
+class InProcessBroker(TaskEventBroker):
+    """Broker for a single process, used in development, tests and single-worker ASGI deployments."""
+
+    max_queue_size = 100
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def publish(self, event: dict):
+        with self._lock:
+            subscribers = list(self._subscribers)
+
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._deliver, queue, event)
+            except RuntimeError:
+                # Event loop of that subscriber is already closed
+                pass
+
+    def subscribe(self, keepalive: float = None):
+        # Register right away (not on first iteration) so no event published after this call is missed
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(maxsize=self.max_queue_size))
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return self._listen(subscriber, keepalive)
+
+    async def _listen(self, subscriber: tuple, keepalive: float = None):
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(subscriber[1].get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscriber)
+
+    @staticmethod
+    def _deliver(queue: asyncio.Queue, event: dict):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A client that does not keep up misses events, the next refresh catches it up
+            logging.warning("Task event stream queue full, dropping event.")
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker() -> TaskEventBroker:
+    """Return the process-wide broker configured by TASK_EVENT_BROKER."""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                broker_path = getattr(settings, 'TASK_EVENT_BROKER', 'modules.task.events.InProcessBroker')
+                _broker = import_string(broker_path)()
+    return _broker
+
+
+def publish_task_event(action: str, task_id: int, **data):
+    """Publish a task event once the current transaction commits."""
+    event = {'action': action, 'id': task_id, **data}
+    transaction.on_commit(lambda: get_broker().publish(event))
@@ -0,0 +1,136 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from auditlog.context import disable_auditlog
+from auditlog.models import LogEntry
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from modules.task.models import Task
+
+
+class WriteCounter:
+    """
+    Execute wrapper counting UPDATE statements and the bytes of their parameters,
+    and the SELECTs of full task rows (what auditlog runs to diff a saved task).
+    """
+
+    def __init__(self):
+        self.updates = 0
+        self.bytes = 0
+        self.row_reads = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        # Quoted the way the backend quotes it, "content" on sqlite / Postgres, `content` on MySQL
+        content = context['connection'].ops.quote_name('content')
+        if sql.startswith('SELECT') and content in sql.split(' FROM ')[0]:
+            with self._lock:
+                self.row_reads += 1
+        if sql.startswith('UPDATE'):
+            size = sum(len(str(param).encode('utf-8')) for param in params or ())
+            with self._lock:
+                self.updates += 1
+                self.bytes += size
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = (
+        "Concurrent editors opening, editing and closing tasks, comparing full model saves "
+        "('full', how lock/unlock/update used to write) with lease updates and update_fields ('fields'). "
+        "Reports UPDATE statements, bytes sent, full row reads (audit diffing) and audit log rows. Benchmark tasks are deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--editors', type=int, default=8, help="Concurrent editor threads.")
+        parser.add_argument('--rounds', type=int, default=50, help="Open / edit / close rounds per editor.")
+        parser.add_argument('--tasks', type=int, default=20, help="Tasks the editors compete for.")
+        parser.add_argument('--content-size', type=int, default=20000, help="Characters of content per task.")
+
+    def handle(self, *args, **options):
+        users = [User.objects.get_or_create(username=f'editor-benchmark-{index}')[0] for index in range(options['editors'])]
+        for mode in ('full', 'fields'):
+            tasks = [
+                Task.objects.create(
+                    title=f"Benchmark task {index}", source="benchmark",
+                    content="x" * options['content_size'], published=timezone.now()
+                )
+                for index in range(options['tasks'])
+            ]
+            task_ids = [task.id for task in tasks]
+            audit_before = self.audit_count(task_ids)
+
+            counter = WriteCounter()
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=len(users)) as executor:
+                refused = sum(executor.map(
+                    lambda user: self.edit(mode, user, task_ids, options['rounds'], counter), users
+                ))
+            elapsed = time.perf_counter() - started
+
+            self.stdout.write(
+                f"{mode:<6} {elapsed:7.2f}s  {counter.updates} UPDATEs  {counter.bytes / 1024 / 1024:8.2f} MB sent  "
+                f"{counter.row_reads} full row reads  {self.audit_count(task_ids) - audit_before} audit rows  {refused} opens refused"
+            )
+            self.cleanup(task_ids)
+
+        User.objects.filter(username__startswith='editor-benchmark-').delete()
+
+    def edit(self, mode: str, user, task_ids: list, rounds: int, counter: WriteCounter) -> int:
+        refused = 0
+        try:
+            with connection.execute_wrapper(counter):
+                for round_number in range(rounds):
+                    task = Task.objects.get(pk=random.choice(task_ids))
+                    if not self.lock(mode, task, user):
+                        refused += 1
+                        continue
+                    # Editors change the title, the large content is left as it is
+                    task.title = f"Edited by {user.username} #{round_number}"
+                    if mode == 'full':
+                        task.save()
+                    else:
+                        task.save(update_fields=['title'])
+                    self.unlock(mode, task, user)
+        finally:
+            connection.close()
+        return refused
+
+    @staticmethod
+    def lock(mode: str, task: Task, user) -> bool:
+        if mode == 'fields':
+            return task.lock_task(user)
+        if task.is_locked and task.locked_by_id != user.id and task.lease_expires_at and task.lease_expires_at > timezone.now():
+            return False
+        task.locked_by = user
+        task.is_locked = True
+        task.lease_expires_at = timezone.now() + timedelta(minutes=2)
+        task.save()
+        return True
+
+    @staticmethod
+    def unlock(mode: str, task: Task, user):
+        if mode == 'fields':
+            task.unlock_task(user)
+            return
+        task.locked_by = None
+        task.is_locked = False
+        task.lease_expires_at = None
+        task.save()
+
+    @staticmethod
+    def audit_count(task_ids: list) -> int:
+        return LogEntry.objects.filter(content_type=ContentType.objects.get_for_model(Task), object_id__in=task_ids).count()
+
+    @staticmethod
+    def cleanup(task_ids: list):
+        with disable_auditlog():
+            Task.objects.filter(pk__in=task_ids).delete()
+        LogEntry.objects.filter(content_type=ContentType.objects.get_for_model(Task), object_id__in=task_ids).delete()
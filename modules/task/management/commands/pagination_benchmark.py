@@ -0,0 +1,76 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+from django.utils import timezone
+from rest_framework.test import force_authenticate
+
+from modules.task.models import Task
+from modules.task.pagination import KeysetPaginator
+from modules.task.views import DataTableTaskList
+
+
+class Command(BaseCommand):
+    help = (
+        "Time DataTable pages fetched by offset (start=) against the same pages fetched by cursor. "
+        "Seeded rows are rolled back at the end, nothing is left in the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=20000, help="Tasks seeded before timing.")
+        parser.add_argument('--length', type=int, default=10, help="Page size.")
+        parser.add_argument('--pages', type=int, nargs='+', default=[1, 10, 100, 1000], help="Page numbers timed.")
+        parser.add_argument('--repeat', type=int, default=5, help="Requests per page and mode, the fastest one is kept.")
+
+    def handle(self, *args, **options):
+        length = options['length']
+        with transaction.atomic():
+            self.seed(options['tasks'])
+            user = User.objects.create_superuser('pagination-benchmark', password=None)
+            ids = list(Task.objects.order_by('-id').values_list('id', flat=True))
+            paginator = KeysetPaginator(['-id'])
+
+            for page in options['pages']:
+                start = (page - 1) * length
+                if start >= len(ids):
+                    self.stdout.write(self.style.WARNING(f"Page {page} is past the {len(ids)} seeded tasks, skipped."))
+                    continue
+                # The cursor the previous page would have returned
+                cursor = paginator.encode({'id': ids[start - 1]}, KeysetPaginator.NEXT) if start else None
+
+                offset = self.best(user, {'start': start, 'length': length}, options['repeat'])
+                seek = self.best(user, {'start': start, 'length': length, 'cursor': cursor or ''}, options['repeat'])
+                self.stdout.write(f"page {page:>6}  offset {offset * 1000:8.2f} ms  cursor {seek * 1000:8.2f} ms")
+
+            transaction.set_rollback(True)
+
+    def seed(self, count: int):
+        now = timezone.now()
+        existing = Task.objects.count()
+        # bulk_create skips the signals, the search index, cached total and audit log are left alone
+        Task.objects.bulk_create(
+            (
+                Task(title=f"Benchmark task {index}", source="benchmark", content="Lorem ipsum " * 40, published=now)
+                for index in range(count)
+            ),
+            batch_size=1000,
+        )
+        self.stdout.write(f"Seeded {count} tasks on top of {existing}.")
+
+    @staticmethod
+    def best(user, params: dict, repeat: int) -> float:
+        view = DataTableTaskList.as_view()
+        request_factory = RequestFactory()
+        best = None
+        for _ in range(max(repeat, 1)):
+            request = request_factory.get('/task/dt_task', {'draw': 1, **params})
+            force_authenticate(request, user=user)
+            started = time.perf_counter()
+            response = view(request)
+            elapsed = time.perf_counter() - started
+            if response.status_code != 200:
+                raise Exception(f"DataTable request failed with {response.status_code}.")
+            best = elapsed if best is None else min(best, elapsed)
+        return best
@@ -1,6 +1,11 @@
+from datetime import timedelta
+from django.conf import settings
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth.models import User
+from django.utils import timezone
 from auditlog.registry import auditlog
+from modules.task.events import publish_task_event
 
 # Create your models here.
 class Task(models.Model):
@@ -10,20 +15,60 @@ class Task(models.Model):
     published = models.DateTimeField('date published')
     locked_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name="locked_task")
     is_locked = models.BooleanField(default=False)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return self.title
 
     
     
-    def lock_task(self, user):
-        self.locked_by = user
-        self.is_locked = True
-        self.save()
+    def lock_task(self, user, renew: bool = False) -> bool:
+        """
+        Take the edit lease for ``user`` with a single conditional UPDATE.
+        Succeeds when the task is unlocked or the previous lease expired, with
+        ``renew`` also when ``user`` already holds it. Returns False when another
+        user holds a live lease.
+        """
+        now = timezone.now()
+        available = Q(is_locked=False) | Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=now)
+        if renew:
+            available |= Q(locked_by=user)
 
-    def unlock_task(self):
-        self.locked_by = None
-        self.is_locked = False
-        self.save()
+        lease_expires_at = now + timedelta(seconds=settings.TASK_LOCK_TTL)
+        updated = Task.objects.filter(pk=self.pk).filter(available).update(
+            locked_by=user,
+            is_locked=True,
+            lease_expires_at=lease_expires_at
+        )
+        if updated:
+            self.locked_by = user
+            self.is_locked = True
+            self.lease_expires_at = lease_expires_at
+            publish_task_event('locked', self.pk, is_locked=True)
+        return bool(updated)
 
-auditlog.register(Task, exclude_fields=['locked_by', 'is_locked'])
\ No newline at end of file
+    def extend_lock(self, user) -> bool:
+        """Heartbeat, push the lease expiry forward if ``user`` still holds it."""
+        lease_expires_at = timezone.now() + timedelta(seconds=settings.TASK_LOCK_TTL)
+        updated = Task.objects.filter(pk=self.pk, locked_by=user, is_locked=True).update(
+            lease_expires_at=lease_expires_at
+        )
+        if updated:
+            self.lease_expires_at = lease_expires_at
+        return bool(updated)
+
+    def unlock_task(self, user) -> bool:
+        """Release the lease, only when ``user`` holds it."""
+        updated = Task.objects.filter(pk=self.pk, locked_by=user).update(
+            locked_by=None,
+            is_locked=False,
+            lease_expires_at=None
+        )
+        if updated:
+            self.locked_by = None
+            self.is_locked = False
+            self.lease_expires_at = None
+            publish_task_event('unlocked', self.pk, is_locked=False)
+        return bool(updated)
+
+auditlog.register(Task, exclude_fields=['locked_by', 'is_locked', 'lease_expires_at'])
\ No newline at end of file
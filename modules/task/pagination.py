@@ -0,0 +1,176 @@
+import base64
+import binascii
+import hashlib
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q, Subquery
+
+
+class KeysetPaginator:
+    """
+    Seek (keyset) pagination for an ordered queryset.
+
+    Instead of ``LIMIT/OFFSET`` the next page is fetched with a ``WHERE`` on the
+    last row seen, so page 1000 costs the same as page 1. The ordering must end
+    with a unique column (``id``) so the position of every row is unambiguous.
+
+    Cursors are opaque url-safe strings. Each one is bound to the ordering and
+    to a caller supplied ``scope`` (e.g. the search value), a cursor that does
+    not match the current request is ignored and the paginator falls back to
+    plain offset pagination.
+
+    Rows may be dicts from ``values()``. A sort column missing from the row (e.g.
+    a large text column that is not fetched) is stored in the cursor by
+    reference and resolved with a subquery on the last ordering column (the pk).
+    """
+
+    NEXT = 'n'
+    PREVIOUS = 'p'
+
+    def __init__(self, ordering: list[str], scope: str = ''):
+        self.ordering = ordering
+        self.signature = hashlib.sha256(
+            json.dumps([ordering, scope]).encode('utf-8')
+        ).hexdigest()[:16]
+
+    def paginate(self, queryset, start: int, length: int, cursor: str = None) -> dict:
+        """
+        Return one page of ``queryset`` (already ordered by ``self.ordering``).
+
+        :param start: DataTables offset, used when no valid cursor is given
+        :param length: page size
+        :param cursor: opaque cursor returned by a previous page
+        :return: dict with ``rows``, ``next_cursor`` and ``previous_cursor``
+        """
+        position = self.decode(cursor)
+        if position is not None:
+            position = self._typed(queryset, position)
+
+        if position is None:
+            rows = list(queryset[start:start + length + 1])
+            has_next = len(rows) > length
+            has_previous = start > 0
+            rows = rows[:length]
+        elif position['direction'] == self.NEXT:
+            rows = list(queryset.filter(self._seek(queryset, position, self.NEXT))[:length + 1])
+            has_next = len(rows) > length
+            has_previous = True
+            rows = rows[:length]
+        else:
+            reversed_ordering = [self._reverse(field) for field in self.ordering]
+            rows = list(
+                queryset.filter(self._seek(queryset, position, self.PREVIOUS))
+                .order_by(*reversed_ordering)[:length + 1]
+            )
+            has_previous = len(rows) > length
+            has_next = True
+            rows = rows[:length][::-1]
+
+        return {
+            'rows': rows,
+            'next_cursor': self.encode(rows[-1], self.NEXT) if rows and has_next else None,
+            'previous_cursor': self.encode(rows[0], self.PREVIOUS) if rows and has_previous else None,
+        }
+
+    def encode(self, row, direction: str) -> str:
+        """Build the cursor pointing after (or before) ``row``."""
+        names = [field.lstrip('-') for field in self.ordering]
+        payload = {
+            's': self.signature,
+            'd': direction,
+            'v': [self._value(row, name) for name in names],
+            'r': [index for index, name in enumerate(names) if not self._has_value(row, name)],
+        }
+        raw = json.dumps(payload, cls=DjangoJSONEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+    def decode(self, cursor: str):
+        """Return the position stored in ``cursor`` or None if it is missing or stale."""
+        if not cursor:
+            return None
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        except (ValueError, binascii.Error, UnicodeError):
+            return None
+
+        if not isinstance(payload, dict) or payload.get('s') != self.signature:
+            return None
+        if payload.get('d') not in (self.NEXT, self.PREVIOUS):
+            return None
+        if not isinstance(payload.get('v'), list) or len(payload['v']) != len(self.ordering):
+            return None
+        references = payload.get('r', [])
+        # Indexes of sort columns other than the last one (the pk), which is always stored by value
+        if not isinstance(references, list) or len(set(references)) != len(references) or not all(
+            type(index) is int and 0 <= index < len(self.ordering) - 1 for index in references
+        ):
+            return None
+        return {'direction': payload['d'], 'values': payload['v'], 'references': references}
+
+    def _typed(self, queryset, position: dict):
+        """
+        The position with its values converted to the types of their columns, None
+        when one does not fit. Cursors come from the client, a tampered one must not reach the query.
+        """
+        values = list(position['values'])
+        for index, field in enumerate(self.ordering):
+            if index in position['references']:
+                values[index] = None
+                continue
+            value = values[index]
+            if value is None or isinstance(value, (dict, list, bool)):
+                return None
+            name = field.lstrip('-')
+            try:
+                annotation = queryset.query.annotations.get(name)
+                output_field = annotation.output_field if annotation is not None else queryset.model._meta.get_field(name)
+                values[index] = output_field.to_python(value)
+            except (FieldDoesNotExist, ValidationError, TypeError, ValueError):
+                return None
+            if values[index] is None:
+                return None
+        return {**position, 'values': values}
+
+    def _seek(self, queryset, position: dict, direction: str) -> Q:
+        """
+        Build ``(a > x) OR (a = x AND b > y) OR ...`` for the current ordering.
+        Comparison flips for descending columns and for backward seeks.
+        """
+        values = list(position['values'])
+        pk_name = self.ordering[-1].lstrip('-')
+        for index in position['references']:
+            name = self.ordering[index].lstrip('-')
+            values[index] = Subquery(
+                queryset.model._default_manager.filter(**{pk_name: values[-1]}).values(name)[:1]
+            )
+
+        condition = Q()
+        for index, field in enumerate(self.ordering):
+            descending = field.startswith('-')
+            name = field.lstrip('-')
+            forward = (direction == self.NEXT) != descending
+            branch = Q(**{f"{name}__{'gt' if forward else 'lt'}": values[index]})
+            for previous_index in range(index):
+                previous_name = self.ordering[previous_index].lstrip('-')
+                branch &= Q(**{previous_name: values[previous_index]})
+            condition |= branch
+        return condition
+
+    @staticmethod
+    def _reverse(field: str) -> str:
+        return field[1:] if field.startswith('-') else f"-{field}"
+
+    @staticmethod
+    def _has_value(row, name: str) -> bool:
+        return name in row if isinstance(row, dict) else hasattr(row, name)
+
+    @classmethod
+    def _value(cls, row, name: str):
+        if not cls._has_value(row, name):
+            return None
+        if isinstance(row, dict):
+            return row[name]
+        return getattr(row, name)
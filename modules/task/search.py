@@ -0,0 +1,162 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from modules.task.models import Task
+
+SEARCH_FIELDS = ['title', 'source', 'content']
+
+
+class TaskSearchBackend:
+    """
+    Base search backend for Task.
+
+    A backend filters a Task queryset by a search term and annotates every row
+    with ``relevance`` (higher is better). Backends that keep their own index
+    get ``index``/``remove`` calls from the Task post_save/post_delete signals.
+    """
+
+    def install(self):
+        """Create the index if it does not exist yet (called after migrate)."""
+
+    def index(self, task: Task):
+        """Add or refresh a task in the index."""
+
+    def remove(self, task_id: int):
+        """Drop a task from the index."""
+
+    def search(self, queryset, term: str):
+        raise NotImplementedError
+
+    @staticmethod
+    def tokenize(term: str) -> list[str]:
+        """Split the search box value into plain word tokens."""
+        return re.findall(r'\w+', term)
+
+
+class LikeSearchBackend(TaskSearchBackend):
+    """Fallback backend using LIKE '%term%', used when no full-text index is available."""
+
+    def search(self, queryset, term: str):
+        condition = Q()
+        for field in SEARCH_FIELDS:
+            condition |= Q(**{f"{field}__icontains": term})
+        return queryset.filter(condition).annotate(relevance=Value(0.0, output_field=FloatField()))
+
+
+class MySQLFullTextBackend(TaskSearchBackend):
+    """
+    MySQL FULLTEXT index on (title, source, content).
+
+    InnoDB keeps the index up to date on every write, so index/remove are no-ops.
+    Tokens shorter than the server's innodb_ft_min_token_size are not indexed,
+    a search made only of such tokens falls back to LIKE.
+    """
+
+    index_name = 'task_task_fulltext'
+    min_token_size = 3
+
+    def install(self):
+        table = Task._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.STATISTICS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s",
+                [table, self.index_name]
+            )
+            if cursor.fetchone()[0]:
+                return
+            columns = ', '.join(connection.ops.quote_name(field) for field in SEARCH_FIELDS)
+            cursor.execute(
+                f"ALTER TABLE {connection.ops.quote_name(table)} "
+                f"ADD FULLTEXT INDEX {connection.ops.quote_name(self.index_name)} ({columns})"
+            )
+
+    def search(self, queryset, term: str):
+        tokens = [token for token in self.tokenize(term) if len(token) >= self.min_token_size]
+        if not tokens:
+            return LikeSearchBackend().search(queryset, term)
+
+        # Boolean mode: every token is required and matched as a prefix (typeahead)
+        query = ' '.join(f"+{token}*" for token in tokens)
+        table = connection.ops.quote_name(Task._meta.db_table)
+        columns = ', '.join(f"{table}.{connection.ops.quote_name(field)}" for field in SEARCH_FIELDS)
+        relevance = RawSQL(
+            f"MATCH ({columns}) AGAINST (%s IN BOOLEAN MODE)",
+            [query],
+            output_field=FloatField()
+        )
+        return queryset.annotate(relevance=relevance).filter(relevance__gt=0)
+
+
+class SQLiteFTS5Backend(TaskSearchBackend):
+    """
+    SQLite FTS5 virtual table mirroring (title, source, content), rowid = task id.
+    Used for local and test runs, kept in sync by the Task signals.
+    """
+
+    @property
+    def fts_table(self) -> str:
+        return f"{Task._meta.db_table}_fts"
+
+    def install(self):
+        table = connection.ops.quote_name(Task._meta.db_table)
+        fts_table = connection.ops.quote_name(self.fts_table)
+        columns = ', '.join(SEARCH_FIELDS)
+        with connection.cursor() as cursor:
+            cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5({columns})")
+            # Backfill rows created before the index existed
+            cursor.execute(
+                f"INSERT INTO {fts_table} (rowid, {columns}) "
+                f"SELECT id, {columns} FROM {table} WHERE id NOT IN (SELECT rowid FROM {fts_table})"
+            )
+
+    def index(self, task: Task):
+        fts_table = connection.ops.quote_name(self.fts_table)
+        columns = ', '.join(SEARCH_FIELDS)
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {fts_table} WHERE rowid = %s", [task.id])
+            cursor.execute(
+                f"INSERT INTO {fts_table} (rowid, {columns}) VALUES (%s, %s, %s, %s)",
+                [task.id, task.title, task.source, task.content]
+            )
+
+    def remove(self, task_id: int):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {connection.ops.quote_name(self.fts_table)} WHERE rowid = %s", [task_id])
+
+    def search(self, queryset, term: str):
+        tokens = self.tokenize(term)
+        if not tokens:
+            return LikeSearchBackend().search(queryset, term)
+
+        # Quote every token so FTS5 syntax in user input is taken literally, match as prefix
+        query = ' '.join('"{}"*'.format(token.replace('"', '""')) for token in tokens)
+        table = connection.ops.quote_name(Task._meta.db_table)
+        fts_table = connection.ops.quote_name(self.fts_table)
+        # Joined to the index so MATCH runs once per query, not once per row.
+        # bm25() is lower for better matches, negate it so relevance sorts descending like MySQL
+        return queryset.extra(
+            tables=[self.fts_table],
+            where=[f"{fts_table}.rowid = {table}.id", f"{fts_table} MATCH %s"],
+            params=[query],
+        ).annotate(relevance=RawSQL(f"-bm25({fts_table})", [], output_field=FloatField()))
+
+
+def get_search_backend() -> TaskSearchBackend:
+    """
+    Return the configured search backend. ``TASK_SEARCH_BACKEND`` in settings can
+    point to a backend class, otherwise it is picked from the database vendor.
+    """
+    backend_path = getattr(settings, 'TASK_SEARCH_BACKEND', None)
+    if backend_path:
+        return import_string(backend_path)()
+    if connection.vendor == 'mysql':
+        return MySQLFullTextBackend()
+    if connection.vendor == 'sqlite':
+        return SQLiteFTS5Backend()
+    return LikeSearchBackend()
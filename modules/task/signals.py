@@ -0,0 +1,52 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from modules.task.counts import adjust_total_count
+from modules.task.events import publish_task_event
+from modules.task.models import Task
+from modules.task.search import SEARCH_FIELDS, get_search_backend
+
+
+@receiver(post_save, sender=Task)
+def index_task(sender, instance, update_fields=None, **kwargs):
+    """Keep the search index in sync with the saved task."""
+    if update_fields and not set(update_fields) & set(SEARCH_FIELDS):
+        return
+    get_search_backend().index(instance)
+
+
+@receiver(post_delete, sender=Task)
+def unindex_task(sender, instance, **kwargs):
+    """Drop the deleted task from the search index."""
+    get_search_backend().remove(instance.id)
+
+
+@receiver(post_save, sender=Task)
+def push_created_task(sender, instance, created, **kwargs):
+    """Tell open task lists about the new task."""
+    if created:
+        publish_task_event('created', instance.id)
+
+
+@receiver(post_delete, sender=Task)
+def push_deleted_task(sender, instance, **kwargs):
+    """Tell open task lists the task is gone."""
+    publish_task_event('deleted', instance.id)
+
+
+@receiver(post_save, sender=Task)
+def count_created_task(sender, instance, created, **kwargs):
+    """Keep the cached task total in step with inserts."""
+    if created:
+        adjust_total_count(1)
+
+
+@receiver(post_delete, sender=Task)
+def count_deleted_task(sender, instance, **kwargs):
+    """Keep the cached task total in step with deletes."""
+    adjust_total_count(-1)
+
+
+def install_search_index(sender, **kwargs):
+    """Create the full-text index once the task table exists."""
+    get_search_backend().install()
@@ -1,3 +1,476 @@
-from django.test import TestCase
+import asyncio
+import base64
+import json
+import re
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from auditlog import receivers
+from auditlog.context import set_actor
+from auditlog.models import LogEntry
+from django.contrib.auth.models import Group, Permission, User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from modules.job.models import Job
+from modules.media.models import Media
+from modules.task.audit import audit_batch
+from modules.task.counts import count_filtered, get_total_count
+from modules.task.events import InProcessBroker
+from modules.task.models import Task
+from modules.task.pagination import KeysetPaginator
+from modules.task.search import SQLiteFTS5Backend, get_search_backend
+
+
+def create_task(**values) -> Task:
+    return Task.objects.create(**{'title': 'Task', 'source': 'source', 'content': 'content', 'published': timezone.now(), **values})
+
+
+class SearchBackendTest(TestCase):
+
+    def search(self, term: str) -> list[int]:
+        return list(get_search_backend().search(Task.objects.all(), term).order_by('-relevance', '-id').values_list('id', flat=True))
+
+    def test_index_follows_save_and_delete(self):
+        task = create_task(title='Quarterly invoice')
+        self.assertEqual(self.search('invoice'), [task.id])
+
+        task.title = 'Quarterly receipt'
+        task.save()
+        self.assertEqual(self.search('invoice'), [])
+        self.assertEqual(self.search('receipt'), [task.id])
+
+        task_id = task.id
+        task.delete()
+        self.assertNotIn(task_id, self.search('receipt'))
+
+    def test_prefix_match_ranked_by_relevance(self):
+        weak = create_task(title='Report', content='mentions budget once')
+        strong = create_task(title='Budget budget', source='budget', content='budget review')
+        create_task(title='Unrelated')
+        self.assertEqual(self.search('budg'), [strong.id, weak.id])
+
+    def test_fts5_matches_once_per_query(self):
+        if not isinstance(get_search_backend(), SQLiteFTS5Backend):
+            self.skipTest("SQLite FTS5 backend only")
+        create_task(title='Invoice')
+        with CaptureQueriesContext(connection) as queries:
+            self.search('invoice')
+        self.assertEqual(queries.captured_queries[-1]['sql'].count('MATCH'), 1)
+
+
+class DataTableColumnsTest(TestCase):
+
+    def setUp(self):
+        for index in range(15):
+            create_task(title=f'Budget {index}', source=f'Source {index}', content=f'Budget content {index} ' * 50)
+        self.client.force_login(User.objects.create_superuser('admin', password='password'))
+
+    @staticmethod
+    def select_list(sql: str) -> str:
+        """Columns of the outermost SELECT, previews (SUBSTR/LENGTH of content) left out."""
+        depth = 0
+        for index, char in enumerate(sql):
+            depth += {'(': 1, ')': -1}.get(char, 0)
+            if depth == 0 and sql.startswith(' FROM ', index):
+                sql = sql[:index]
+                break
+        return re.sub(r'(SUBSTR|LENGTH)\("task_task"\."content"[^)]*\)', '', sql)
+
+    def assert_no_content_fetched(self, params: dict) -> dict:
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/task/dt_task', {'draw': 1, 'length': 5, **params})
+        self.assertEqual(response.status_code, 200)
+        task_queries = [query['sql'] for query in queries.captured_queries if 'FROM "task_task"' in query['sql']]
+        self.assertTrue(task_queries)
+        for sql in task_queries:
+            self.assertNotIn('"task_task"."content"', self.select_list(sql), sql)
+        return response.json()
+
+    def test_every_sort_column(self):
+        for column in range(3):
+            for direction in ('asc', 'desc'):
+                with self.subTest(column=column, direction=direction):
+                    data = self.assert_no_content_fetched({'order[0][column]': column, 'order[0][dir]': direction})
+                    self.assertEqual(len(data['data']), 5)
+                    self.assertTrue(data['data'][0]['content'].endswith('...'))
+
+    def test_search(self):
+        data = self.assert_no_content_fetched({'search[value]': 'budget'})
+        self.assertEqual(data['recordsFiltered'], 15)
+
+    def test_content_sorted_cursor(self):
+        params = {'order[0][column]': 2, 'order[0][dir]': 'asc'}
+        first = self.assert_no_content_fetched(params)
+        second = self.assert_no_content_fetched({**params, 'cursor': first['next_cursor']})
+        offset = self.assert_no_content_fetched({**params, 'start': 5})
+        self.assertEqual([row['id'] for row in second['data']], [row['id'] for row in offset['data']])
+
+    def test_tampered_cursor_falls_back_to_offset(self):
+        def cursor(ordering: list, values: list, references=None) -> str:
+            payload = {'s': KeysetPaginator(ordering).signature, 'd': 'n', 'v': values, 'r': references or []}
+            return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+        title_asc = {'order[0][column]': 0, 'order[0][dir]': 'asc'}
+        expected = self.client.get('/task/dt_task', {'draw': 1, 'length': 5, **title_asc}).json()['data']
+        for name, params in {
+            'dict value': {'cursor': cursor(['title', 'id'], [{'a': 1}, 3]), **title_asc},
+            'string id': {'cursor': cursor(['title', 'id'], ['Budget 1', 'abc']), **title_asc},
+            'non-int reference': {'cursor': cursor(['title', 'id'], [None, 3], ['x']), **title_asc},
+            'reference out of range': {'cursor': cursor(['title', 'id'], [None, 3], [5]), **title_asc},
+            'reference to the pk': {'cursor': cursor(['title', 'id'], ['Budget 1', 3], [1]), **title_asc},
+        }.items():
+            with self.subTest(name):
+                response = self.client.get('/task/dt_task', {'draw': 1, 'length': 5, **params})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()['data'], expected)
+
+        response = self.client.get('/task/dt_task', {'draw': 1, 'length': 5, 'cursor': cursor(['-id'], ['abc'])})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['data']), 5)
+
+
+class DataTableQueryCountTest(TestCase):
+
+    def setUp(self):
+        for index in range(60):
+            create_task(title=f'Task {index}')
+        user = User.objects.create_user('editor', password='password')
+        group = Group.objects.create(name='editors')
+        group.permissions.add(Permission.objects.get(codename='change_task'))
+        user.groups.add(group)
+        user.user_permissions.add(Permission.objects.get(codename='add_task'))
+        self.client.force_login(user)
+        # Fill the cached total, it is not counted per request
+        cache.clear()
+        get_total_count()
+
+    def test_queries_do_not_grow_with_page_length(self):
+        for length in (1, 10, 50):
+            with self.subTest(length=length):
+                # session, user, page, attachments, groups, user permissions, group permissions
+                with self.assertNumQueries(7):
+                    response = self.client.get('/task/dt_task', {'draw': 1, 'length': length})
+                data = response.json()
+                self.assertEqual(len(data['data']), length)
+                self.assertEqual(
+                    data['user_permissions'],
+                    {'add_task': True, 'change_task': True, 'delete_task': False}
+                )
+
+
+class TaskLeaseTest(TestCase):
+
+    def setUp(self):
+        self.task = create_task()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+
+    def expire_lease(self):
+        Task.objects.filter(pk=self.task.pk).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+    def test_competing_lock_fails(self):
+        self.assertTrue(self.task.lock_task(self.alice))
+        self.assertFalse(Task.objects.get(pk=self.task.pk).lock_task(self.bob))
+        self.assertEqual(Task.objects.get(pk=self.task.pk).locked_by, self.alice)
+
+    def test_expired_lease_is_reclaimed(self):
+        self.task.lock_task(self.alice)
+        self.expire_lease()
+        self.assertTrue(Task.objects.get(pk=self.task.pk).lock_task(self.bob))
+        self.assertEqual(Task.objects.get(pk=self.task.pk).locked_by, self.bob)
+
+    def test_renew_only_for_the_holder(self):
+        self.task.lock_task(self.alice)
+        self.assertFalse(self.task.lock_task(self.alice), "a second open without renew is refused")
+        self.assertTrue(self.task.lock_task(self.alice, renew=True))
+        self.assertFalse(self.task.lock_task(self.bob, renew=True))
+
+    def test_extend_after_losing_the_lease(self):
+        self.task.lock_task(self.alice)
+        self.expire_lease()
+        Task.objects.get(pk=self.task.pk).lock_task(self.bob)
+        self.assertFalse(self.task.extend_lock(self.alice))
+        self.assertTrue(Task.objects.get(pk=self.task.pk).extend_lock(self.bob))
+
+    def test_unlock_by_non_holder(self):
+        self.task.lock_task(self.alice)
+        self.assertFalse(self.task.unlock_task(self.bob))
+        task = Task.objects.get(pk=self.task.pk)
+        self.assertTrue(task.is_locked)
+        self.assertEqual(task.locked_by, self.alice)
+        self.assertTrue(task.unlock_task(self.alice))
+        self.assertFalse(Task.objects.get(pk=self.task.pk).is_locked)
+
+
+class TaskUpdatePageTest(TestCase):
+
+    def test_page_opens_with_a_cold_content_type_cache(self):
+        task = create_task()
+        Media.objects.create(
+            collection_name='data_entry_task', file_name='file.png', file_path='data_entry_task/file.png', mime_type='image/png',
+            size=1, content_type=ContentType.objects.get_for_model(Task), object_id=task.id, custom_properties={'ocr': []}, disk='s3'
+        )
+        self.client.force_login(User.objects.create_user('editor'))
+
+        # A fresh worker has no content types cached, looking up the renditions then queries for them
+        ContentType.objects.clear_cache()
+        with mock.patch('components.storage_component.StorageComponent.generate_signed_url', return_value='https://signed/file.png'):
+            response = self.client.get(f'/task/task_update/{task.id}/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['image_url'], 'https://signed/file.png')
+
+
+class TaskOcrTest(TestCase):
+
+    def setUp(self):
+        self.task = create_task()
+        self.client.force_login(User.objects.create_user('reader', password='password'))
+
+    def attach(self, mime_type: str, **custom_properties) -> Media:
+        return Media.objects.create(
+            collection_name='data_entry_task', file_name='file', file_path='data_entry_task/file', mime_type=mime_type,
+            size=1, content_type=ContentType.objects.get_for_model(Task), object_id=self.task.id,
+            custom_properties=custom_properties, disk='s3'
+        )
+
+    def test_other_attachments_are_not_read(self):
+        self.attach('application/pdf')
+        response = self.client.get(f'/task/task_ocr/{self.task.id}/')
+        self.assertEqual(response.json(), {'lines': []})
+        self.assertFalse(Job.objects.filter(name='media.ocr').exists())
+
+    def test_extracted_text_is_returned(self):
+        self.attach('image/png', ocr=['first line'])
+        response = self.client.get(f'/task/task_ocr/{self.task.id}/')
+        self.assertEqual(response.json(), {'lines': ['first line']})
+
+    def test_pending_while_the_job_runs(self):
+        self.attach('image/png')
+        with mock.patch('modules.media.jobs.get_ocr_pool') as get_ocr_pool:
+            for _ in range(3):
+                response = self.client.get(f'/task/task_ocr/{self.task.id}/')
+                self.assertEqual(response.status_code, 202)
+                self.assertEqual(response.json(), {'lines': [], 'pending': True})
+        # Page views only wait for the job queued with the upload, they never start recognition themselves
+        get_ocr_pool.assert_not_called()
+        self.assertEqual(Job.objects.filter(name='media.ocr').count(), 1)
+
+    def test_finished_job_without_text_is_not_pending(self):
+        self.attach('image/png')
+        # The job skipped a file replaced before it ran
+        Job.objects.filter(name='media.ocr').update(status=Job.Status.DONE)
+        response = self.client.get(f'/task/task_ocr/{self.task.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'lines': []})
+
+    def test_failed_job_is_reported(self):
+        self.attach('image/png')
+        Job.objects.filter(name='media.ocr').update(status=Job.Status.FAILED)
+        response = self.client.get(f'/task/task_ocr/{self.task.id}/')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json(), {'lines': [], 'error': "Text recognition failed."})
+        self.assertEqual(Job.objects.filter(name='media.ocr').count(), 1)
+
+
+class AuditBatchTest(TestCase):
+    """audit_batch() copies auditlog's receivers, its entries have to stay the same as auditlog's own."""
+
+    fields = ('content_type_id', 'object_pk', 'object_id', 'object_repr', 'serialized_data', 'action', 'changes', 'actor_id', 'remote_addr', 'additional_data')
+
+    def setUp(self):
+        self.user = User.objects.create_user('auditor', password='password')
+
+    def entry(self) -> dict:
+        return LogEntry.objects.order_by('-id').values(*self.fields).first()
+
+    def test_entries_match_auditlogs(self):
+        # Each change is logged by both, on the same instance state
+        with set_actor(self.user, remote_addr='203.0.113.7'):
+            with audit_batch():
+                task = create_task()
+            batched = self.entry()
+            receivers.log_create(sender=Task, instance=task, created=True)
+            self.assertEqual(batched, self.entry())
+
+            task.title = 'Changed'
+            receivers.log_update(sender=Task, instance=task, update_fields=['title'])
+            expected = self.entry()
+            with audit_batch():
+                task.save(update_fields=['title'])
+            self.assertEqual(self.entry(), expected)
+
+            receivers.log_delete(sender=Task, instance=task)
+            expected = self.entry()
+            with audit_batch():
+                task.delete()
+            self.assertEqual(self.entry(), expected)
+
+        self.assertEqual(expected['actor_id'], self.user.id)
+        self.assertEqual(expected['remote_addr'], '203.0.113.7')
+
+    def test_entries_are_written_on_commit_only(self):
+        with self.assertRaises(RuntimeError), audit_batch():
+            create_task()
+            raise RuntimeError
+        self.assertFalse(LogEntry.objects.exists())
+
+        with audit_batch():
+            for _ in range(3):
+                create_task()
+            self.assertFalse(LogEntry.objects.exists())
+        self.assertEqual(LogEntry.objects.count(), 3)
+
+    def test_task_update_writes_its_entry_with_the_save(self):
+        task = create_task()
+        self.client.force_login(self.user)
+        response = self.client.post(f'/task/task_update/{task.id}/', {
+            'title': 'Edited', 'source': task.source, 'content': task.content, 'date': task.published.strftime('%Y-%m-%d'),
+        }, REMOTE_ADDR='203.0.113.7')
+        self.assertEqual(response.status_code, 302)
+
+        entry = LogEntry.objects.get(action=LogEntry.Action.UPDATE)
+        self.assertEqual(entry.changes['title'], ['Task', 'Edited'])
+        self.assertEqual((entry.actor_id, entry.remote_addr), (self.user.id, '203.0.113.7'))
+        task.refresh_from_db()
+        self.assertFalse(task.is_locked)
+
+
+class TaskCountTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        for index in range(10):
+            create_task(title=f'Task {index}')
+
+    def test_total_is_counted_once(self):
+        self.assertEqual(get_total_count(), 10)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_total_count(), 10)
+
+    def test_create_and_delete_adjust_the_total_on_commit(self):
+        get_total_count()
+        with self.captureOnCommitCallbacks(execute=True):
+            task = create_task()
+            self.assertEqual(get_total_count(), 10, "not before the commit")
+        self.assertEqual(get_total_count(), 11)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            task.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_total_count(), 10)
+
+    def test_rolled_back_create_leaves_the_total(self):
+        get_total_count()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                create_task()
+                raise RuntimeError
+        self.assertEqual(callbacks, [])
+        self.assertEqual(get_total_count(), 10)
+
+    def test_filtered_count_above_the_threshold_is_approximate(self):
+        with override_settings(TASK_COUNT_APPROXIMATE_THRESHOLD=5):
+            self.assertEqual(count_filtered(Task.objects.all()), (5, True))
+            self.assertEqual(count_filtered(Task.objects.filter(title__in=['Task 1', 'Task 2'])), (2, False))
+        self.assertEqual(count_filtered(Task.objects.all()), (10, False))
+
+
+class TaskEventTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('editor', password='password')
+        patcher = mock.patch('modules.task.events.get_broker')
+        self.broker = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def published(self) -> list:
+        return [call.args[0] for call in self.broker.publish.call_args_list]
+
+    def test_lock_and_unlock_publish_on_commit(self):
+        task = create_task()
+        with self.captureOnCommitCallbacks(execute=True):
+            task.lock_task(self.user)
+            self.assertEqual(self.published(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            task.unlock_task(self.user)
+        self.assertEqual(self.published(), [
+            {'action': 'locked', 'id': task.id, 'is_locked': True},
+            {'action': 'unlocked', 'id': task.id, 'is_locked': False},
+        ])
+
+    def test_create_and_delete_publish_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            task = create_task()
+            task_id = task.id
+            task.delete()
+            self.assertEqual(self.published(), [])
+        self.assertEqual(self.published(), [{'action': 'created', 'id': task_id}, {'action': 'deleted', 'id': task_id}])
+
+    def test_nothing_is_published_after_a_rollback(self):
+        task = create_task()
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                task.lock_task(self.user)
+                create_task()
+                raise RuntimeError
+        self.assertEqual(self.published(), [])
+
+
+class InProcessBrokerTest(TestCase):
+
+    async def test_subscribers_receive_events_and_keepalives(self):
+        broker = InProcessBroker()
+        first, second = broker.subscribe(keepalive=0.05), broker.subscribe(keepalive=0.05)
+        broker.publish({'action': 'locked', 'id': 1})
+        self.assertEqual(await anext(first), {'action': 'locked', 'id': 1})
+        self.assertEqual(await anext(second), {'action': 'locked', 'id': 1})
+        self.assertIsNone(await anext(first))
+
+        await first.aclose()
+        await second.aclose()
+        self.assertEqual(broker._subscribers, set())
+
+    async def test_stream_view_sends_frames_and_unsubscribes_on_disconnect(self):
+        user = await sync_to_async(User.objects.create_user)('reader', password='password')
+        await self.async_client.aforce_login(user)
+        broker = InProcessBroker()
+        disconnected = asyncio.Event()
+        messages = asyncio.Queue()
+
+        async def receive():
+            if not hasattr(receive, 'sent'):
+                receive.sent = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': '/task/events', 'raw_path': b'/task/events', 'query_string': b'', 'root_path': '',
+            'headers': [(b'host', b'testserver'), (b'cookie', f"sessionid={self.async_client.cookies['sessionid'].value}".encode())],
+            'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        }
+        with mock.patch('modules.task.views.get_broker', return_value=broker):
+            server = asyncio.create_task(ASGIHandler()(scope, receive, messages.put))
+
+            start = await asyncio.wait_for(messages.get(), 5)
+            self.assertEqual(start['status'], 200)
+            self.assertIn((b'Content-Type', b'text/event-stream'), start['headers'])
+            self.assertEqual((await asyncio.wait_for(messages.get(), 5))['body'], b'retry: 5000\n\n')
+
+            broker.publish({'action': 'locked', 'id': 7, 'is_locked': True})
+            frame = (await asyncio.wait_for(messages.get(), 5))['body']
+            self.assertEqual(frame, b'event: locked\ndata: {"action": "locked", "id": 7, "is_locked": true}\n\n')
+            self.assertEqual(len(broker._subscribers), 1)
+
+            disconnected.set()
+            await asyncio.wait_for(server, 5)
+        self.assertEqual(broker._subscribers, set())
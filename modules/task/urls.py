@@ -5,7 +5,10 @@ urlpatterns = [
     path('', views.task_index, name="task_index"),
     path('task_create', views.task_create, name='task_create'),
     path('task_update/<int:task_id>/', views.task_update, name='task_update'),
+    path('task_ocr/<int:task_id>/', views.task_ocr, name='task_ocr'),
     path('task_delete/<int:task_id>/', views.task_delete, name='task_delete'),
     path('task_unlock/', views.unlock_task, name='unlock_task'),
+    path('task_heartbeat/', views.task_heartbeat, name='task_heartbeat'),
+    path('events', views.task_events, name='task_events'),
     path('dt_task', views.DataTableTaskList.as_view()),
 ]
\ No newline at end of file
@@ -1,17 +1,29 @@
-from components.image_component import ImageComponent
 from components.storage_component import StorageComponent
+from asgiref.sync import sync_to_async
 from datetime import datetime
+import asyncio
+import json
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, permission_required
-from django.contrib.contenttypes.models import ContentType
-from django.db import transaction
-from django.db.models import Q
-from django.http import JsonResponse
-from django.shortcuts import get_object_or_404, render, redirect
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import BooleanField, ExpressionWrapper, Q
+from django.db.models.functions import Length, Substr
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, get_object_or_404, render, redirect
+from django.utils import timezone
 from django.utils.timezone import make_aware
 from django.views.decorators.csrf import csrf_exempt
+from modules.job.models import Job
+from modules.media.jobs import queue_ocr, queue_remove, queue_upload
 from modules.media.models import Media
+from modules.task.audit import audit_batch
+from modules.task.counts import count_filtered, get_total_count
+from modules.task.events import get_broker
 from modules.task.models import Task 
+from modules.task.pagination import KeysetPaginator
+from modules.task.search import get_search_backend
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
@@ -32,18 +44,18 @@ def task_create(request):
     try:
         if request.method == 'POST':
                 
-            task = Task.objects.create(
-                title=request.POST.get('title'),
-                source=request.POST.get('source'),
-                content=request.POST.get('content'),
-                published=make_aware(datetime.strptime(request.POST.get('date'), "%Y-%m-%d")) if request.POST.get('date') else None
-            )
-
             try:
-                if 'file' in request.FILES:
-                    file = request.FILES['file']
-                    storage = StorageComponent()
-                    storage.disk('s3').upload_file(file, model_instance=task, collection_name="data_entry_task")
+                # The task, its audit entry and the upload job commit together
+                with audit_batch():
+                    task = Task.objects.create(
+                        title=request.POST.get('title'),
+                        source=request.POST.get('source'),
+                        content=request.POST.get('content'),
+                        published=make_aware(datetime.strptime(request.POST.get('date'), "%Y-%m-%d")) if request.POST.get('date') else None
+                    )
+                    if 'file' in request.FILES:
+                        # Uploaded to S3 by the job worker, the request does not wait for it
+                        queue_upload(request.FILES['file'], model_instance=task, collection_name="data_entry_task")
             except Exception as exception:
                 messages.error(request, str(exception))
                 return redirect('task_index')
@@ -58,70 +70,94 @@ def task_create(request):
 
 # Updating task
 @login_required(login_url="/login")
-def task_update(request, task_id):
+async def task_update(request, task_id):
     try:
-        task = get_object_or_404(Task, id=task_id)
+        user = await request.auser()
+        task = await aget_object_or_404(Task, id=task_id)
 
-        if task.is_locked:
-            if task.locked_by != request.user:
+        # Atomic lease, submitting the form renews the lease the user already holds
+        if not await sync_to_async(task.lock_task)(user, renew=request.method == 'POST'):
+            if task.locked_by_id != user.id:
                 messages.warning(request, "This task is currently being edited by another user.")
             else:
                 messages.warning(request, "Task already opened.")
             return redirect('task_index')
 
-        task.lock_task(request.user)
-
         storage = StorageComponent().disk('s3')
-        existing_file = Media.objects.filter(
-            content_type=ContentType.objects.get_for_model(Task),
-            object_id=task.id
-        ).first()
+        existing_file = await (await sync_to_async(Media.objects.for_instance)(task)).afirst()
 
         if request.method == 'POST':
-            task.title = request.POST.get('title', task.title)
-            task.source = request.POST.get('source', task.source)
-            task.content = request.POST.get('content', task.content)
+            values = {
+                'title': request.POST.get('title', task.title),
+                'source': request.POST.get('source', task.source),
+                'content': request.POST.get('content', task.content),
+            }
             
             try:
                 published_date = request.POST.get('date')
-                task.published = make_aware(datetime.strptime(published_date, "%Y-%m-%d")) if published_date else task.published
+                values['published'] = make_aware(datetime.strptime(published_date, "%Y-%m-%d")) if published_date else task.published
             except ValueError:
                 messages.error(request, "Invalid date format.")
                 return redirect('task_update', task_id=task_id)
 
-            task.save()
+            # Write only the columns that changed, an unchanged form costs no UPDATE and no audit entry
+            changed_fields = [field for field, value in values.items() if getattr(task, field) != value]
+            for field in changed_fields:
+                setattr(task, field, values[field])
 
             try:
-                if 'file' in request.FILES:
-                    file = request.FILES['file']
-                    is_uploaded = storage.upload_file(file, model_instance=task, collection_name="data_entry_task")
-                    if is_uploaded and existing_file and storage.is_exist(existing_file.file_path):
-                        storage.remove(existing_file.file_path)
-
-                    
+                await sync_to_async(save_task_with_file)(task, changed_fields, request.FILES.get('file'), user)
             except Exception as exception:
                 messages.error(request, str(exception))
                 return redirect('task_update', task_id=task_id)
 
-            task.unlock_task()
             messages.success(request, "Task updated successfully.")
             return redirect('task_index')
 
         else:
-            user_groups = request.user.groups.values_list('name', flat=True)
-            image_url = None
-            image_to_text = None
+            async def signed_url():
+                if not existing_file:
+                    return None
+                # The Media row vouches for the object, no existence check needed
+                return await storage.agenerate_signed_url(existing_file.file_path, verify_exists=False)
+
+            async def signed_renditions():
+                if not existing_file:
+                    return []
+                # Only renditions of the current file, those of a replaced one are being regenerated
+                # The generic relation resolves its content type with a query, build it on the ORM thread
+                renditions = [
+                    rendition async for rendition in await sync_to_async(Media.objects.for_instance)(existing_file)
+                    if rendition.custom_properties.get('source_path') == existing_file.file_path
+                ]
+                urls = await asyncio.gather(*(
+                    storage.agenerate_signed_url(rendition.file_path, verify_exists=False) for rendition in renditions
+                ))
+                return [(url, rendition.custom_properties) for url, rendition in zip(urls, renditions)]
+
+            # Signing runs in storage threads while the groups query runs on the ORM thread
+            user_groups, image_url, renditions = await asyncio.gather(
+                sync_to_async(list)(user.groups.values_list('name', flat=True)),
+                signed_url(),
+                signed_renditions()
+            )
 
-            if existing_file:
-                image_url = storage.generate_signed_url(existing_file.file_path)
-                #image_to_text = ImageComponent.image_to_text(image_url=image_url)
+            # The browser downloads the smallest candidate covering the image's width on screen
+            image_srcset = None
+            if renditions:
+                candidates = [(url, properties['width']) for url, properties in renditions]
+                candidates.append((image_url, renditions[0][1]['source_width']))
+                image_srcset = ', '.join(f"{url} {width}w" for url, width in sorted(candidates, key=lambda candidate: candidate[1]))
 
-            return render(request, 'task_update.html', {
+            return await sync_to_async(render)(request, 'task_update.html', {
                 'task': task,
                 'image_url': image_url,
-                'image_to_text': image_to_text,
+                'image_srcset': image_srcset,
+                # Extracted when the image was uploaded, None while that job is pending
+                'image_to_text': existing_file.custom_properties.get('ocr') if existing_file else None,
                 'existing_file': existing_file,
-                'user_groups': user_groups
+                'user_groups': user_groups,
+                'lock_ttl': settings.TASK_LOCK_TTL,
             })
 
     except Exception as exception:
@@ -129,29 +165,62 @@ def task_update(request, task_id):
         return redirect('task_index')
     
 
-# Deleting taks
-@permission_required("task.delete_task", login_url="/login", raise_exception=True)
+# Text of the task image, requested by the update page once it has rendered
 @login_required(login_url="/login")
-def task_delete(request, task_id):
-    try:
-        storage = StorageComponent().disk('s3')
+async def task_ocr(request, task_id):
+    existing_file = await (await sync_to_async(Media.objects.for_instances)([task_id], model=Task)).afirst()
+    if not existing_file or not existing_file.is_image:
+        # Only images are read, other attachments have no text to show
+        return JsonResponse({'lines': []})
+    if 'ocr' in existing_file.custom_properties:
+        return JsonResponse({'lines': existing_file.custom_properties['ocr']})
+
+    # Recognition only ever runs in the job worker, which stores the text on the Media row.
+    # The job of this upload is returned when queued already, rows stored before OCR jobs existed get theirs now
+    job = await sync_to_async(queue_ocr)(existing_file)
+    if job.status == Job.Status.FAILED:
+        return JsonResponse({'lines': [], 'error': "Text recognition failed."}, status=500)
+    if job.status == Job.Status.DONE:
+        # Finished after the row was read, or the file was replaced meanwhile
+        await existing_file.arefresh_from_db(fields=['custom_properties'])
+        return JsonResponse({'lines': existing_file.custom_properties.get('ocr', [])})
+
+    return JsonResponse({'lines': [], 'pending': True}, status=202)
+
+
+def save_task_with_file(task: Task, update_fields: list, file, user):
+    """Save the changed columns, queue the new file and release the lease in one transaction."""
+    with audit_batch():
+        if update_fields:
+            task.save(update_fields=update_fields)
+        if file is not None:
+            # The job worker uploads the new file and removes the one it replaces
+            queue_upload(file, model_instance=task, collection_name="data_entry_task")
+        task.unlock_task(user)
+
+
+def delete_task_with_files(task_id: int):
+    """Delete a task and its Media row, queueing the file removal in the same transaction."""
+    with audit_batch():
+        # Retrieve the associated file
+        existing_file = Media.objects.for_instances([task_id], model=Task).first()
 
-        with transaction.atomic():
-            # Retrieve the associated file
-            existing_file = Media.objects.filter(
-                content_type=ContentType.objects.get_for_model(Task),
-                object_id=task_id
-            ).first()
+        task = get_object_or_404(Task, id=task_id)
+        task.delete()
 
-            task = get_object_or_404(Task, id=task_id)
-            task.delete()
+        if existing_file:
+            # The removal job commits with the delete, the worker only removes the file once it is final
+            queue_remove(existing_file)
+            existing_file.delete()
 
-            if existing_file:
-                existing_file.delete()
 
-        # if no exception thrown in transaction then we confirm delete the file in storage
-        if existing_file and storage.is_exist(existing_file.file_path):
-            storage.remove(existing_file.file_path)
+# Deleting taks
+@permission_required("task.delete_task", login_url="/login", raise_exception=True)
+@login_required(login_url="/login")
+async def task_delete(request, task_id):
+    try:
+        # Transactions are sync only, run the whole unit on the ORM thread
+        await sync_to_async(delete_task_with_files)(task_id)
 
         messages.success(request, "Task and associated files deleted successfully.")
         return redirect("task_index")
@@ -176,12 +245,61 @@ def unlock_task(request):
             task = Task.objects.filter(id=task_id).first()
             if not task:
                 return JsonResponse({"status": "error", "message": "Task not found."}, status=404)
-            task.unlock_task()
+            if not task.unlock_task(request.user):
+                return JsonResponse({"status": "error", "message": "Task is not locked by you."}, status=409)
             return JsonResponse({"status": "success", "message": "Task unlocked."})
         return JsonResponse({"status": "error", "message": "Task ID not provided."}, status=400)
     return JsonResponse({"status": "error", "message": "Invalid request method."}, status=405)
 
 
+# Extending the edit lease while the task page is open
+@login_required(login_url="/login")
+def task_heartbeat(request):
+    """
+    The task update page calls this periodically to keep its lease alive.
+    A tab that dies stops sending heartbeats, the lease then expires and the
+    next user opening the task reclaims it.
+    """
+    if request.method == "POST":
+        task_id = request.POST.get("task_id")
+        if task_id:
+            task = Task.objects.filter(id=task_id).first()
+            if not task:
+                return JsonResponse({"status": "error", "message": "Task not found."}, status=404)
+            if not task.extend_lock(request.user):
+                return JsonResponse({"status": "error", "message": "Task lock lost."}, status=409)
+            return JsonResponse({"status": "success", "lease_expires_at": task.lease_expires_at})
+        return JsonResponse({"status": "error", "message": "Task ID not provided."}, status=400)
+    return JsonResponse({"status": "error", "message": "Invalid request method."}, status=405)
+
+
+# Streaming task changes to the task list (server-sent events)
+@login_required(login_url="/login")
+async def task_events(request):
+    """
+    Pushes lock/unlock and create/delete events so the task list can patch its
+    rows instead of reloading. The stream is held open, so it is only served
+    under ASGI (mysite/asgi.py), a WSGI worker would be blocked by it.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({"status": "error", "message": "Event stream requires ASGI."}, status=501)
+
+    events = get_broker().subscribe(keepalive=15)
+
+    async def stream():
+        yield "retry: 5000\n\n"
+        async for event in events:
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: {event['action']}\ndata: {json.dumps(event, cls=DjangoJSONEncoder)}\n\n"
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 # Using rest framework API to datatable
 class DataTableTaskList(APIView):
     permission_classes = [IsAuthenticated]
@@ -191,57 +309,91 @@ class DataTableTaskList(APIView):
         search_value = request.GET.get('search[value]', '')
         start = int(request.GET.get('start', 0))
         length = int(request.GET.get('length', 10))
-        order_column_index = int(request.GET.get('order[0][column]', 0))
+        order_column = request.GET.get('order[0][column]')
+        order_column_index = int(order_column) if order_column is not None else None
         order_dir = request.GET.get('order[0][dir]', 'asc')
 
         columns = ['title', 'source', 'content']
 
         queryset = Task.objects.all()
 
-        # Q search filter
+        # Full-text search filter, annotates each row with its relevance
         if search_value:
-            queryset = queryset.filter(
-                Q(title__icontains=search_value) | 
-                Q(source__icontains=search_value)
-            )
+            queryset = get_search_backend().search(queryset, search_value)
 
-        # Total filtered records
-        records_filtered = queryset.count()
+        # Total record count, served from the cache
+        records_total = get_total_count()
 
-        # Apply ordering
-        if order_column_index < len(columns):
+        # Total filtered records, without a search it is the total
+        if search_value:
+            records_filtered, is_approximate = count_filtered(queryset)
+        else:
+            records_filtered, is_approximate = records_total, False
+
+        # Apply ordering, always ending with id so keyset pagination has a unique key
+        if order_column_index is not None and order_column_index < len(columns):
             column_name = columns[order_column_index]
             if order_dir == 'asc':
-                queryset = queryset.order_by(column_name)
+                ordering = [column_name, 'id']
             else:
-                queryset = queryset.order_by(f"-{column_name}")
+                ordering = [f"-{column_name}", '-id']
+        elif search_value:
+            ordering = ['-relevance', '-id']
         else:
-            queryset = queryset.order_by('-id')
-
-        # Apply pagination
-        queryset = queryset[start:start + length]
-
-        # Total record count
-        records_total = Task.objects.count()
+            ordering = ['-id']
+        queryset = queryset.order_by(*ordering)
+
+        # Fetch only the rendered columns, previews are cut in SQL so full bodies never leave the DB
+        fields = ['id', 'title']
+        fields += [field.lstrip('-') for field in ordering if field.lstrip('-') not in fields + ['content']]
+        queryset = queryset.values(
+            *fields,
+            is_lock_active=ExpressionWrapper(
+                Q(is_locked=True, lease_expires_at__gt=timezone.now()),
+                output_field=BooleanField()
+            ),
+            source_preview=Substr('source', 1, 30),
+            source_length=Length('source'),
+            content_preview=Substr('content', 1, 50),
+            content_length=Length('content'),
+        )
+
+        # Apply pagination, seek from the cursor when given, otherwise use start/length
+        paginator = KeysetPaginator(ordering, scope=search_value)
+        page = paginator.paginate(queryset, start, length, cursor=request.GET.get('cursor'))
 
         data = [
             {
-                'title': obj.title,
-                'source': (obj.source[:30] + "...") if len(obj.source) > 10 else obj.source,
-                'content': (obj.content[:50] + "...") if len(obj.content) > 10 else obj.content,
-                'id': obj.id,
-                'edit_url': '/task/task_update/' + str(obj.id),
-                'delete_url': '/task/task_delete/' + str(obj.id),
-                'is_locked': obj.is_locked,
-                'user_groups': request.user.groups.values_list('name', flat=True),
+                'title': row['title'],
+                'source': (row['source_preview'] + "...") if row['source_length'] > 10 else row['source_preview'],
+                'content': (row['content_preview'] + "...") if row['content_length'] > 10 else row['content_preview'],
+                'id': row['id'],
+                'edit_url': '/task/task_update/' + str(row['id']),
+                'delete_url': '/task/task_delete/' + str(row['id']),
+                'is_locked': row['is_lock_active'],
             }
-            for obj in queryset
+            for row in page['rows']
         ]
 
+        # Attachment presence of the whole page in one query
+        attached = Media.objects.attached_ids([row['id'] for row in data], model=Task)
+        for row in data:
+            row['has_attachment'] = row['id'] in attached
+
         # Return JSON
         return Response({
             'draw': int(request.GET.get('draw', 1)),
             'recordsTotal': records_total,
             'recordsFiltered': records_filtered,
+            'recordsFilteredApproximate': is_approximate,
             'data': data,
+            # Resolved once per request, not per row
+            'user_groups': list(request.user.groups.values_list('name', flat=True)),
+            'user_permissions': {
+                'add_task': request.user.has_perm('task.add_task'),
+                'change_task': request.user.has_perm('task.change_task'),
+                'delete_task': request.user.has_perm('task.delete_task'),
+            },
+            'next_cursor': page['next_cursor'],
+            'previous_cursor': page['previous_cursor'],
         })
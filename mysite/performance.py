@@ -0,0 +1,248 @@
+import contextlib
+import json
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger('performance')
+
+# Timings of the request being served, None outside of one (management commands, job worker)
+_timings = ContextVar('request_timings', default=None)
+# Storage calls made by another storage call (cache disk -> wrapped disk) are not counted twice
+_in_storage_call = ContextVar('in_storage_call', default=False)
+
+
+class RequestTimings:
+    """
+    Where the time of one request went. The same instance is shared by the
+    threads sync_to_async runs the request's code in (storage calls gathered
+    on the executor, the ORM thread), so counters are only changed under ``lock``.
+    """
+
+    def __init__(self, sampled: bool = False):
+        self.started = time.perf_counter()
+        self.sampled = sampled  # Keep the SQL and storage calls themselves, for the slow request log
+        self.db_count = 0
+        self.db_time = 0.0
+        self.storage = defaultdict(lambda: [0, 0.0])  # operation -> [count, seconds]
+        self.ocr_time = 0.0
+        self.template_time = 0.0
+        self.queries = []
+        self.storage_calls = []
+        self.lock = threading.RLock()
+
+    @property
+    def storage_time(self) -> float:
+        return sum(seconds for _, seconds in self.storage.values())
+
+    def server_timing(self, total: float) -> str:
+        """Value of the Server-Timing header, durations in milliseconds."""
+        with self.lock:
+            return self._server_timing(total)
+
+    def _server_timing(self, total: float) -> str:
+        metrics = [
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.db_count} queries"',
+            f'storage;dur={self.storage_time * 1000:.1f};desc="{sum(count for count, _ in self.storage.values())} calls"',
+        ]
+        for operation, (count, seconds) in sorted(self.storage.items()):
+            metrics.append(f'storage-{operation};dur={seconds * 1000:.1f};desc="{count} calls"')
+        if self.ocr_time:
+            metrics.append(f'ocr;dur={self.ocr_time * 1000:.1f}')
+        metrics.append(f'template;dur={self.template_time * 1000:.1f}')
+        metrics.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(metrics)
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return self._as_dict()
+
+    def _as_dict(self) -> dict:
+        return {
+            'db_queries': self.db_count,
+            'db_ms': round(self.db_time * 1000, 1),
+            'storage': {
+                operation: {'count': count, 'ms': round(seconds * 1000, 1)}
+                for operation, (count, seconds) in self.storage.items()
+            },
+            'ocr_ms': round(self.ocr_time * 1000, 1),
+            'template_ms': round(self.template_time * 1000, 1),
+        }
+
+
+def record_storage(disk: str, operation: str, seconds: float, path: str = None):
+    timings = _timings.get()
+    if timings is None:
+        return
+    with timings.lock:
+        entry = timings.storage[operation]
+        entry[0] += 1
+        entry[1] += seconds
+        if timings.sampled:
+            timings.storage_calls.append({'disk': disk, 'operation': operation, 'path': path, 'ms': round(seconds * 1000, 1)})
+
+
+@contextlib.contextmanager
+def storage_call(disk: str, operation: str, path: str = None):
+    """Time a StorageComponent call into the current request, calls nested in it are left out."""
+    if _in_storage_call.get():
+        yield
+        return
+    token = _in_storage_call.set(True)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _in_storage_call.reset(token)
+        record_storage(disk, operation, time.perf_counter() - started, path)
+
+
+@contextlib.contextmanager
+def ocr_call():
+    """Time waiting for text recognition into the current request."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = _timings.get()
+        if timings is not None:
+            seconds = time.perf_counter() - started
+            with timings.lock:
+                timings.ocr_time += seconds
+
+
+def time_query(execute, sql, params, many, context):
+    """Database execute wrapper, installed on every connection."""
+    timings = _timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        seconds = time.perf_counter() - started
+        with timings.lock:
+            timings.db_count += 1
+            timings.db_time += seconds
+            if timings.sampled:
+                timings.queries.append({'sql': sql, 'ms': round(seconds * 1000, 2)})
+
+
+def install_query_timer(sender, connection, **kwargs):
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+connection_created.connect(install_query_timer, dispatch_uid='performance.install_query_timer')
+
+
+class TimedTemplate:
+    """Template of the backend below, timing its render into the current request."""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            timings = _timings.get()
+            if timings is not None:
+                seconds = time.perf_counter() - started
+                with timings.lock:
+                    timings.template_time += seconds
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Django template backend reporting render time to PerformanceMiddleware."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+class PerformanceMiddleware:
+    """
+    Measure DB queries, storage calls, OCR and template rendering of each
+    request. The totals go out as a Server-Timing header and a DEBUG line on the
+    'performance' logger. A share of the requests (PERFORMANCE_SLOW_REQUEST_SAMPLE_RATE)
+    also keep every query and storage call, logged when the request turns out
+    slower than PERFORMANCE_SLOW_REQUEST_MS.
+
+    First in MIDDLEWARE, so the total covers the rest of the stack.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        timings = self.start()
+        token = _timings.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            _timings.reset(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = self.start()
+        token = _timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _timings.reset(token)
+        return self.finish(request, response, timings)
+
+    @staticmethod
+    def start() -> RequestTimings:
+        return RequestTimings(sampled=random.random() < getattr(settings, 'PERFORMANCE_SLOW_REQUEST_SAMPLE_RATE', 0))
+
+    @staticmethod
+    def finish(request, response, timings: RequestTimings):
+        total = time.perf_counter() - timings.started
+        if getattr(settings, 'PERFORMANCE_SERVER_TIMING', True):
+            response['Server-Timing'] = timings.server_timing(total)
+
+        line = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'ms': round(total * 1000, 1),
+            **timings.as_dict(),
+        }
+        # Every request, so only when the 'performance' logger is set to DEBUG
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps(line))
+
+        slow_ms = getattr(settings, 'PERFORMANCE_SLOW_REQUEST_MS', None)
+        if timings.sampled and slow_ms is not None and total * 1000 >= slow_ms:
+            logger.warning(json.dumps({
+                **line,
+                'slow': True,
+                'queries': timings.queries,
+                'storage_calls': timings.storage_calls,
+            }))
+        return response
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -46,9 +47,11 @@ INSTALLED_APPS = [
     'modules.main.apps.MainConfig',
     'modules.task.apps.TaskConfig',
     'modules.media.apps.MediaConfig',
+    'modules.job.apps.JobConfig',
 ]
 
 MIDDLEWARE = [
+    'mysite.performance.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,7 +66,8 @@ ROOT_URLCONF = 'mysite.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates reporting render time to PerformanceMiddleware
+        'BACKEND': 'mysite.performance.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -139,3 +143,83 @@ STATICFILES_DIRS = [
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Task search backend (dotted path), picked from the database vendor when not set:
+# MySQL FULLTEXT index on mysql, FTS5 table on sqlite, LIKE otherwise
+# TASK_SEARCH_BACKEND = 'modules.task.search.LikeSearchBackend'
+
+# Seconds the cached task total (DataTable recordsTotal) lives before being recounted.
+# The default cache is per process, configure a shared CACHES backend when running several workers.
+TASK_COUNT_CACHE_TIMEOUT = 300
+
+# Stop counting search results after this many rows and report an approximate
+# recordsFiltered, None counts exactly
+TASK_COUNT_APPROXIMATE_THRESHOLD = None
+
+# Seconds a task edit lease lives without a heartbeat, the update page renews it every third of this
+TASK_LOCK_TTL = 120
+
+# Broker behind the task event stream (/task/events), the in-process broker only
+# reaches clients connected to the same process
+TASK_EVENT_BROKER = 'modules.task.events.InProcessBroker'
+
+# Seconds a job worker may hold a job before it is considered dead and the job is retried
+JOB_LEASE_SECONDS = 300
+
+# OCR worker processes (defaults to the number of CPUs), jobs allowed to wait or run
+# before submits are refused, and seconds Tesseract may spend on one image
+OCR_WORKERS = None
+OCR_QUEUE_SIZE = 16
+OCR_TIMEOUT = 30
+
+# Overrides of components.ocr_component.DEFAULT_PREPROCESSING (downscale, threshold,
+# deskew and text region stages run before Tesseract), e.g. {'source_dpi': 600} to downscale
+# scans whose files do not record their resolution
+OCR_PREPROCESSING = {}
+
+# WebP renditions generated for every uploaded image, name -> longest side in pixels.
+# Pages pick the smallest one covering the space the image is shown in.
+MEDIA_RENDITIONS = {
+    'thumbnail': 320,
+    'preview': 1024,
+}
+MEDIA_RENDITION_QUALITY = 80
+
+# Where audit_batch() (modules.task.audit) writes the audit log entries it collected:
+# 'bulk' inserts them in one statement before the batch commits, 'job' commits one
+# job carrying them and leaves the insert to the job worker
+AUDITLOG_SINK = 'bulk'
+
+# Request instrumentation (mysite.performance.PerformanceMiddleware): add the Server-Timing
+# header, and for this share of the requests keep every SQL query and storage call,
+# logged on the 'performance' logger when the request takes at least PERFORMANCE_SLOW_REQUEST_MS
+PERFORMANCE_SERVER_TIMING = True
+PERFORMANCE_SLOW_REQUEST_SAMPLE_RATE = 0.1
+PERFORMANCE_SLOW_REQUEST_MS = 1000
+
+# Receives a latency / bytes / error observation per StorageComponent call. PrometheusExporter
+# keeps them per process and serves them at /metrics, InMemoryExporter only keeps them
+# (StorageComponent().disk(...).metrics())
+STORAGE_METRICS_EXPORTER = 'components.storage_component.PrometheusExporter'
+# Scrapers of /metrics send "Authorization: Bearer <METRICS_TOKEN>". Without a token only
+# METRICS_ALLOWED_IPS may scrape, they are matched against REMOTE_ADDR, which behind a reverse
+# proxy on the same host is 127.0.0.1 for every client: set a token when running behind one
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+METRICS_ALLOWED_IPS = ['127.0.0.1']
+
+# Disk whole stored files are read from instead of the disk they live on, for the OCR and
+# rendition jobs. s3_cache keeps the s3 objects they read on local disk (config/storage.py)
+STORAGE_READ_DISKS = {'s3': 's3_cache'}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # Slow request breakdowns as warnings, DEBUG adds one JSON line per request
+        'performance': {'handlers': ['console'], 'level': os.getenv('PERFORMANCE_LOG_LEVEL') or 'INFO', 'propagate': False},
+    },
+}
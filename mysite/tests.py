@@ -0,0 +1,92 @@
+import contextvars
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from mysite.performance import RequestTimings, _timings, record_storage
+
+
+class MetricsViewTest(TestCase):
+
+    @override_settings(METRICS_TOKEN='', METRICS_ALLOWED_IPS=['127.0.0.1'])
+    def test_allowed_addresses_without_a_token(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='127.0.0.1').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7').status_code, 403)
+
+    @override_settings(METRICS_TOKEN='secret', METRICS_ALLOWED_IPS=['127.0.0.1'])
+    def test_token_is_required_once_set(self):
+        # Behind a reverse proxy on the same host every client comes from 127.0.0.1
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='127.0.0.1').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('text/plain', response['Content-Type'])
+
+
+class PerformanceMiddlewareTest(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('reader'))
+
+    @staticmethod
+    def server_timing(response) -> dict:
+        """Server-Timing metrics by name, each as (milliseconds, description)."""
+        metrics = {}
+        for metric in response['Server-Timing'].split(', '):
+            name, duration, *description = metric.split(';')
+            metrics[name] = (float(duration.removeprefix('dur=')), description[0].removeprefix('desc=').strip('"') if description else None)
+        return metrics
+
+    def test_server_timing_header(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/task/')
+        metrics = self.server_timing(response)
+
+        self.assertEqual(list(metrics), ['db', 'storage', 'template', 'total'])
+        self.assertEqual(metrics['db'][1], f"{len(queries)} queries")
+        self.assertEqual(metrics['storage'], (0.0, "0 calls"))
+        self.assertGreater(metrics['template'][0], 0)
+        self.assertGreaterEqual(metrics['total'][0], metrics['db'][0] + metrics['template'][0])
+        for metric in response['Server-Timing'].split(', '):
+            self.assertRegex(metric, re.compile(r'^[a-z-]+;dur=\d+\.\d(;desc="[^"]*")?$'))
+
+    def test_storage_operations_are_listed(self):
+        timings = RequestTimings()
+        timings.storage['put'] = [2, 0.5]
+        timings.storage['exists'] = [1, 0.0125]
+        timings.db_count, timings.db_time = 3, 0.004
+
+        self.assertEqual(timings.server_timing(1), ', '.join([
+            'db;dur=4.0;desc="3 queries"',
+            'storage;dur=512.5;desc="3 calls"',
+            'storage-exists;dur=12.5;desc="1 calls"',
+            'storage-put;dur=500.0;desc="2 calls"',
+            'template;dur=0.0',
+            'total;dur=1000.0',
+        ]))
+
+    @override_settings(PERFORMANCE_SERVER_TIMING=False)
+    def test_header_can_be_turned_off(self):
+        self.assertNotIn('Server-Timing', self.client.get('/task/'))
+
+    def test_request_line_is_debug(self):
+        with self.assertLogs('performance', level='DEBUG') as logs:
+            self.client.get('/task/')
+        self.assertEqual([record.levelname for record in logs.records], ['DEBUG'])
+
+    def test_storage_threads_share_the_counters(self):
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        try:
+            # What sync_to_async does for every storage call of an async view
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                for _ in range(8):
+                    executor.submit(contextvars.copy_context().run, lambda: [record_storage('s3', 'put', 0.001) for _ in range(2000)])
+        finally:
+            _timings.reset(token)
+        self.assertEqual(timings.storage['put'][0], 16000)
+        self.assertAlmostEqual(timings.storage['put'][1], 16)
@@ -17,8 +17,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from mysite import views
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('modules.main.urls')),
     path('task/', include('modules.task.urls')),
+    path('metrics', views.metrics, name='metrics'),
 ]
\ No newline at end of file
@@ -0,0 +1,25 @@
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotFound
+
+from components.storage_component import PrometheusExporter, get_metrics_exporter
+
+
+def metrics(request):
+    """
+    Storage metrics of this process in the Prometheus text format, for scrapers holding
+    METRICS_TOKEN, or on METRICS_ALLOWED_IPS when no token is set.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token:
+        allowed = hmac.compare_digest(request.headers.get('Authorization', '').encode(), f"Bearer {token}".encode())
+    else:
+        allowed = request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', [])
+    if not allowed:
+        return HttpResponseForbidden()
+
+    exporter = get_metrics_exporter()
+    if not isinstance(exporter, PrometheusExporter):
+        return HttpResponseNotFound()
+    return HttpResponse(exporter.render(), content_type='text/plain; version=0.0.4; charset=utf-8')